@@ -1,31 +1,102 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from asyncpg.exceptions import QueryCanceledError
 import uvicorn
+import asyncio
+import importlib.util
+import os
 from contextlib import asynccontextmanager
 
 
-from database import db_init, db_seeder
+from settings import settings
+from database import (db_init, db_seeder, db_connect, db_pool_open, db_pool_close, get_db_connection,
+                      admission_samples, Overloaded)
 from routes import (auth_router, user_router, book_router,
-                    genre_router, author_router, reports_router)
+                    genre_router, author_router, reports_router,
+                    autocomplete_router, batch_router, health_router,
+                    metrics_router, jobs_router, api_keys_router)
+from utils import listener, autocomplete_index, report_cache, metrics
+from utils.autocomplete import CHANNEL as AUTOCOMPLETE_CHANNEL
+from utils.encoding import ContentNegotiationMiddleware
+from utils.api_keys import api_key_cache, bootstrap_credentials, CHANNEL as API_KEYS_CHANNEL
+from jobs.runner import job_runner, CHANNEL as JOBS_CHANNEL
 
 
+async def db_migrate():
+    await db_init()
+    await db_seeder()
+    connection = await db_connect()
+    try:
+        await bootstrap_credentials(connection)
+    finally:
+        await connection.close()
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     ''' app startup '''
-    await db_init()
-    await db_seeder()
+    app.state.ready = False
+    if settings.run_migrations:
+        await db_migrate()
+    await db_pool_open()
+
+    # listen first, so no change is lost between loading and subscribing
+    await listener.subscribe(AUTOCOMPLETE_CHANNEL, autocomplete_index.on_notify)
+    await listener.subscribe(report_cache.channel, report_cache.on_notify)
+    await listener.subscribe(JOBS_CHANNEL, job_runner.on_notify)
+    await listener.subscribe(API_KEYS_CHANNEL, api_key_cache.on_notify)
+    # what the notifications missed while the listener was disconnected
+    listener.on_reconnect(autocomplete_index.load)
+    listener.on_reconnect(report_cache.resync)
+    listener.on_reconnect(api_key_cache.resync)
+    await listener.start()
+    async for connection in get_db_connection():
+        await autocomplete_index.load(connection)
+        await report_cache.load(connection)
+    app.state.ready = True
+    await job_runner.start()
     yield
     ''' app shutdown '''
+    app.state.ready = False
+    await job_runner.stop()
+    await listener.stop()
+    await db_pool_close()
 
 
 app = FastAPI(title='Library API', lifespan=lifespan)
+app.include_router(health_router)
 app.include_router(auth_router)
+app.include_router(api_keys_router)
 app.include_router(user_router)
 app.include_router(book_router)
 app.include_router(genre_router)
 app.include_router(author_router)
 app.include_router(reports_router)
+app.include_router(autocomplete_router)
+app.include_router(batch_router)
+app.include_router(jobs_router)
+app.include_router(metrics_router)
+metrics.register(admission_samples)
+
+
+# shed load fast instead of letting requests pile up behind slow queries
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=503,
+        content={'detail': 'Database is overloaded, retry later'},
+        headers={'Retry-After': str(settings.retry_after_seconds)}
+    )
+
+
+@app.exception_handler(QueryCanceledError)
+async def statement_timeout_handler(request: Request, exc: QueryCanceledError):
+    return JSONResponse(
+        status_code=503,
+        content={'detail': 'Query took too long'},
+        headers={'Retry-After': str(settings.retry_after_seconds)}
+    )
 
 
 # cors midlleware
@@ -36,7 +107,26 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ContentNegotiationMiddleware, minimum_size=settings.compression_min_size)
 
 
 if __name__ == '__main__':
-    uvicorn.run(app, host='0.0.0.0', port=5000, log_level='info')
\ No newline at end of file
+    # migrate once here instead of in every worker, workers inherit the flag through env
+    asyncio.run(db_migrate())
+    settings.run_migrations = False
+    os.environ['RUN_MIGRATIONS'] = 'false'
+
+    loop = 'uvloop' if importlib.util.find_spec('uvloop') else 'asyncio'
+    http = 'httptools' if importlib.util.find_spec('httptools') else 'h11'
+
+    uvicorn.run(
+        app if settings.workers == 1 else 'app:app',
+        host='0.0.0.0',
+        port=5000,
+        log_level='info',
+        workers=settings.workers,
+        loop=loop,
+        http=http,
+        # one shutdown budget: requests drain first, then running jobs get jobs_shutdown_timeout
+        timeout_graceful_shutdown=max(1, settings.graceful_shutdown_timeout - settings.jobs_shutdown_timeout)
+    )
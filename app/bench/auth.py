@@ -0,0 +1,83 @@
+'''
+API key auth overhead benchmark.
+
+Creates a temporary key and times the api_key_auth dependency: cached keys
+(the hot path every request takes), cache misses that query ApiKeys, and
+rejected keys. Also times one login password check.
+
+    cd app && python -m bench.auth --iterations 100000
+'''
+from fastapi import HTTPException, Request
+import argparse
+import asyncio
+import statistics
+import time
+
+from database import db_pool_open, db_pool_close, acquire_connection
+from depends import api_key_auth
+from utils.api_keys import api_key_cache, RateLimit
+from utils.passwords import verify_password, DUMMY_HASH
+
+
+def request(method: str = 'GET') -> Request:
+    return Request({'type': 'http', 'method': method, 'path': '/', 'headers': []})
+
+
+async def timed(fn, iterations: int) -> list:
+    durations = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await fn()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+def report(name: str, durations: list):
+    durations.sort()
+    print(f'{name}: mean {statistics.mean(durations) * 1e6:.1f} us, '
+          f'p50 {durations[len(durations) // 2] * 1e6:.1f} us, '
+          f'p99 {durations[int(len(durations) * 0.99)] * 1e6:.1f} us')
+
+
+async def main(iterations: int, misses: int):
+    await db_pool_open()
+    # the lookup limit would turn most timed misses into Overloaded
+    api_key_cache._lookups = RateLimit(float('inf'), float('inf'))
+    async with acquire_connection() as connection:
+        id_key, api_key = await api_key_cache.create(connection, 'bench', ['read'], 3600)
+    try:
+        get = request()
+
+        async def hit():
+            await api_key_auth(get, api_key)
+
+        async def miss():
+            api_key_cache.clear()
+            await api_key_auth(get, api_key)
+
+        async def rejected():
+            try:
+                await api_key_auth(get, 'lib_invalid')
+            except HTTPException:
+                pass
+
+        await hit()
+        report('cached key', await timed(hit, iterations))
+        report('uncached key (one query)', await timed(miss, misses))
+        report('invalid key (negative cache)', await timed(rejected, iterations))
+
+        started = time.perf_counter()
+        verify_password('password', DUMMY_HASH)
+        print(f'login password check: {(time.perf_counter() - started) * 1e3:.1f} ms')
+    finally:
+        async with acquire_connection() as connection:
+            await connection.execute('DELETE FROM ApiKeys WHERE id_key = $1', id_key)
+        await db_pool_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--misses', type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.iterations, args.misses))
@@ -0,0 +1,105 @@
+'''
+High-contention checkout benchmark.
+
+Many concurrent clients try to borrow the same few books through the
+add_borrows handler, returning each book --hold seconds after a successful
+checkout. Reports throughput, conflicts and checks, while checkouts are
+outstanding, that no book was lent twice.
+
+    cd app && python -m bench.checkout --clients 64 --books 5 --seconds 10 --hold 0.005
+'''
+from collections import Counter
+from datetime import date, timedelta
+from fastapi import HTTPException
+import argparse
+import asyncio
+import asyncpg
+import random
+import time
+
+from settings import settings
+from schemas import BookBorrow
+from routes.books import add_borrows
+
+
+async def client(pool: asyncpg.Pool, books: list, users: list, deadline: float, hold: float,
+                 stats: dict, created: list, held: Counter):
+    while time.perf_counter() < deadline:
+        borrow = BookBorrow(
+            books_ids=[random.choice(books)],
+            borrow_date=date.today(),
+            return_date=date.today() + timedelta(days=14)
+        )
+        async with pool.acquire() as connection:
+            try:
+                result = await add_borrows(id_user=random.choice(users), books_borrows=borrow, connection=connection)
+            except HTTPException:
+                stats['conflicts'] += 1
+                continue
+
+            id_borrow = result['borrows'][0]['id_borrow']
+            id_book = result['borrows'][0]['id_book']
+            created.append(id_borrow)
+            stats['checkouts'] += 1
+            # the book is open from the insert until the return below, any other open checkout is a double lend
+            if held[id_book]:
+                stats['double_lends'] += 1
+            held[id_book] += 1
+            await asyncio.sleep(hold)
+            # released before the return commits, so the next checkout of the book is never counted by mistake
+            held[id_book] -= 1
+            await connection.execute('UPDATE BorrowReturnLogs SET is_returned = TRUE WHERE id_borrow = $1', id_borrow)
+
+
+async def watch_open_duplicates(pool: asyncpg.Pool, books: list, deadline: float, stats: dict):
+    ''' samples the log while checkouts are outstanding, after the run every borrow is returned '''
+    while time.perf_counter() < deadline:
+        duplicates = await pool.fetchval('''
+            SELECT COUNT(*) FROM (
+                SELECT id_book FROM BorrowReturnLogs
+                WHERE NOT is_returned AND id_book = ANY($1::uuid[])
+                GROUP BY id_book HAVING COUNT(*) > 1
+            ) AS duplicates
+        ''', books)
+        stats['open_duplicates'] = max(stats['open_duplicates'], duplicates)
+        await asyncio.sleep(0.05)
+
+
+async def main(clients: int, books_count: int, seconds: float, hold: float):
+    # one more connection for the duplicate watcher
+    pool = await asyncpg.create_pool(settings.db_url, min_size=clients + 1, max_size=clients + 1)
+    books = [row['id_book'] for row in await pool.fetch('''
+        SELECT id_book FROM Books b
+        WHERE NOT EXISTS (SELECT 1 FROM BorrowReturnLogs br WHERE br.id_book = b.id_book AND NOT br.is_returned)
+        LIMIT $1
+    ''', books_count)]
+    users = [row['id_user'] for row in await pool.fetch('SELECT id_user FROM Users LIMIT 100')]
+
+    stats = {'checkouts': 0, 'conflicts': 0, 'double_lends': 0, 'open_duplicates': 0}
+    created = []
+    held = Counter()
+    started = time.perf_counter()
+    deadline = started + seconds
+    await asyncio.gather(
+        watch_open_duplicates(pool, books, deadline, stats),
+        *(client(pool, books, users, deadline, hold, stats, created, held) for _ in range(clients))
+    )
+    elapsed = time.perf_counter() - started
+
+    await pool.execute('DELETE FROM BorrowReturnLogs WHERE id_borrow = ANY($1::uuid[])', created)
+    await pool.close()
+
+    print(f'clients: {clients}, books: {len(books)}, seconds: {elapsed:.1f}')
+    print(f'checkouts: {stats["checkouts"]} ({stats["checkouts"] / elapsed:.0f}/s)')
+    print(f'conflicts: {stats["conflicts"]} ({stats["conflicts"] / elapsed:.0f}/s)')
+    print(f'double lends: {stats["double_lends"]}, most books open twice at once: {stats["open_duplicates"]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--books', type=int, default=5)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--hold', type=float, default=0.005)
+    args = parser.parse_args()
+    asyncio.run(main(args.clients, args.books, args.seconds, args.hold))
@@ -0,0 +1,74 @@
+'''
+Response encoding benchmark.
+
+Takes the /books list and the /reports/borrows/geo FeatureCollection from the
+database (or JSON files given with --file) and reports, for every media type
+and content encoding the API offers, the bytes sent and the CPU time the
+middleware spends producing them.
+
+    cd app && python -m bench.encoding --books 1000 --repeat 20
+    cd app && python -m bench.encoding --file books.json
+'''
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+import argparse
+import asyncio
+import time
+
+from database import db_pool_open, db_pool_close, acquire_read_connection
+from routes.books import get_books
+from routes.reports import get_borrowed_users_geo
+from utils.encoding import JSON, COLUMNAR, MSGPACK, encode, compress, msgpack, brotli
+
+
+async def load_payloads(books: int) -> dict:
+    await db_pool_open()
+    try:
+        async with acquire_read_connection() as connection:
+            # the undecorated handlers, so neither the cache nor coalescing is measured
+            book_list = await get_books.__wrapped__(None, None, 0, books, '', False, connection=connection)
+            geo = await get_borrowed_users_geo.__wrapped__(None, connection=connection)
+    finally:
+        await db_pool_close()
+    return {
+        f'/books?limit={books}': JSONResponse(jsonable_encoder(book_list)).body,
+        '/reports/borrows/geo': JSONResponse(jsonable_encoder(geo)).body,
+    }
+
+
+def measure(name: str, body: bytes, repeat: int):
+    media_types = [JSON, COLUMNAR] + ([MSGPACK] if msgpack is not None else [])
+    encodings = [None, 'gzip'] + (['br'] if brotli is not None else [])
+
+    print(f'{name}: {len(body)} bytes of JSON')
+    for media_type in media_types:
+        for encoding in encodings:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                encoded = encode(body, media_type)
+                if encoding is not None:
+                    encoded = compress(encoded, encoding)
+            elapsed = (time.perf_counter() - started) / repeat
+            print(f'  {media_type:40} {encoding or "identity":8} '
+                  f'{len(encoded):>10} bytes {len(encoded) / len(body):6.1%} {elapsed * 1e3:8.2f} ms')
+
+
+async def main(books: int, files: list, repeat: int):
+    if files:
+        payloads = {}
+        for path in files:
+            with open(path, 'rb') as file:
+                payloads[path] = file.read()
+    else:
+        payloads = await load_payloads(books)
+    for name, body in payloads.items():
+        measure(name, body, repeat)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--books', type=int, default=1000)
+    parser.add_argument('--file', action='append', default=[])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.books, args.file, args.repeat))
@@ -0,0 +1,71 @@
+'''
+Keep-alive HTTP load generator for measuring serving throughput.
+
+Run it against the app started with different WORKERS values to compare
+how requests per second scale with cores.
+
+    cd app && python -m bench.http_load --path "/books?limit=10" --connections 64 --seconds 10
+'''
+from settings import settings
+import argparse
+import asyncio
+import time
+
+
+async def read_response(reader: asyncio.StreamReader) -> int:
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    length = 0
+    for line in head.split(b'\r\n'):
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':', 1)[1])
+    await reader.readexactly(length)
+    return status
+
+
+async def connection(host: str, port: int, request: bytes, deadline: float, latencies: list, errors: list):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            writer.write(request)
+            status = await read_response(reader)
+            if status >= 400:
+                errors.append(status)
+            latencies.append(time.perf_counter() - started)
+    finally:
+        writer.close()
+
+
+async def main(host: str, port: int, path: str, connections: int, seconds: float):
+    request = (
+        f'GET {path} HTTP/1.1\r\n'
+        f'Host: {host}\r\n'
+        f'Api-Key: {settings.api_key}\r\n'
+        '\r\n'
+    ).encode()
+    latencies = []
+    errors = []
+    started = time.perf_counter()
+    deadline = started + seconds
+    await asyncio.gather(*(
+        connection(host, port, request, deadline, latencies, errors) for _ in range(connections)
+    ))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f'requests: {len(latencies)} ({len(latencies) / elapsed:.0f}/s), errors: {len(errors)}')
+    if latencies:
+        print(f'latency p50: {latencies[len(latencies) // 2] * 1000:.1f} ms, '
+              f'p99: {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--path', default='/books?limit=10')
+    parser.add_argument('--connections', type=int, default=64)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port, args.path, args.connections, args.seconds))
@@ -1 +1,6 @@
-from .engine import db_init, db_seeder, get_db_connection
\ No newline at end of file
+from .engine import (db_init, db_seeder, db_connect, db_pool_open,
+                     db_pool_close, get_db_connection, get_db_read_connection,
+                     get_db_priority_connection,
+                     acquire_connection, acquire_read_connection, acquire_job_connection,
+                     admission_samples)
+from .admission import Overloaded
\ No newline at end of file
@@ -0,0 +1,86 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+
+class Overloaded(Exception):
+    ''' the admission queue is full or the wait took too long '''
+
+
+class AdmissionGate:
+    '''
+    Bounds the requests holding or waiting for connections of one pool.
+    Waiters are admitted by priority (lower first), then in arrival order.
+    Instead of queueing without limit behind a slow query, requests beyond
+    max_waiting or waiting longer than max_wait are rejected at once.
+    '''
+
+    def __init__(self, name: str, capacity: int, max_waiting: int, max_wait: float):
+        self.name = name
+        self.capacity = capacity
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self._free = capacity
+        self._waiting = 0
+        # waiters not handed a slot yet, a handed one may still be waking up
+        self._pending = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        # cumulative per route class, read by the metrics collector
+        self.admitted: Dict[str, int] = defaultdict(int)
+        self.wait_seconds: Dict[str, float] = defaultdict(float)
+        self.rejected: Dict[Tuple[str, str], int] = defaultdict(int)
+
+    async def enter(self, priority: int, route_class: str):
+        started = time.perf_counter()
+        if self._free > 0 and not self._pending:
+            self._free -= 1
+        else:
+            if self._waiting >= self.max_waiting:
+                self.rejected[(route_class, 'queue_full')] += 1
+                raise Overloaded()
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._order), future))
+            self._waiting += 1
+            self._pending += 1
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if future.done():
+                    # the slot was handed over right as the wait ended
+                    self.leave()
+                else:
+                    future.cancel()
+                    self._pending -= 1
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self.rejected[(route_class, 'timeout')] += 1
+                raise Overloaded()
+            finally:
+                self._waiting -= 1
+        self.admitted[route_class] += 1
+        self.wait_seconds[route_class] += time.perf_counter() - started
+
+    def leave(self):
+        # hand the slot straight to the next waiter, so newcomers cannot overtake it
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                self._pending -= 1
+                return
+        self._free += 1
+
+    def samples(self):
+        ''' (name, labels, value) for the metrics endpoint '''
+        pool = {'pool': self.name}
+        yield 'db_admission_in_use', pool, self.capacity - self._free
+        yield 'db_admission_waiting', pool, self._waiting
+        for route_class, count in self.admitted.items():
+            yield 'db_admission_wait_seconds_count', {**pool, 'route_class': route_class}, count
+            yield 'db_admission_wait_seconds_sum', {**pool, 'route_class': route_class}, self.wait_seconds[route_class]
+        for (route_class, reason), count in self.rejected.items():
+            yield 'db_admission_rejected_total', {**pool, 'route_class': route_class, 'reason': reason}, count
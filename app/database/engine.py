@@ -1,33 +1,275 @@
+import asyncio
 import asyncpg
-from typing import AsyncGenerator
+import collections
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Dict, List, Optional
 from settings import settings
+from .admission import AdmissionGate, Overloaded
 
 
-async def get_db_connection() -> AsyncGenerator[asyncpg.Connection, None]:
-    connection = await asyncpg.connect(
+logger = logging.getLogger(__name__)
+
+_pool: Optional[asyncpg.Pool] = None
+# dsn -> pool of the replicas connected so far, the lag monitor keeps trying the others
+_replica_pools: Dict[str, asyncpg.Pool] = {}
+# replicas within the allowed lag, refreshed by the lag monitor
+_fresh_replicas: List[asyncpg.Pool] = []
+_replica_counter = itertools.count()
+_lag_monitor: Optional[asyncio.Task] = None
+_gates: Dict[asyncpg.Pool, AdmissionGate] = {}
+
+# route class -> (admission priority, lower goes first; statement timeout in ms)
+ROUTE_CLASSES = {
+    'priority': (0, settings.db_priority_statement_timeout),
+    'default': (1, settings.db_statement_timeout),
+    'report': (2, settings.db_report_statement_timeout),
+}
+
+# WAL positions as byte offsets, a standby reports how far it has replayed
+PRIMARY_LSN_QUERY = "SELECT pg_current_wal_lsn() - '0/0'::pg_lsn"
+REPLICA_LSN_QUERY = '''
+    SELECT CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END - '0/0'::pg_lsn
+'''
+
+
+def pool_max_size() -> int:
+    # one connection of the worker share is kept for the LISTEN connection
+    return max(settings.db_pool_min_size, settings.db_connection_budget // settings.workers - 1)
+
+
+async def db_connect() -> asyncpg.Connection:
+    return await asyncpg.connect(
         host=settings.db_host,
         port=settings.db_port,
         user=settings.db_user,
         password=settings.db_password,
         database=settings.db_name
     )
+
+
+def replica_pool_max_size() -> int:
+    return max(settings.db_pool_min_size, settings.db_replica_connection_budget // settings.workers)
+
+
+async def _connect_replicas(server_settings: Dict[str, str]):
+    ''' a replica that is down at boot or later gets no reads, it is connected to once it is back '''
+    for number, dsn in enumerate(settings.db_replica_urls):
+        if dsn in _replica_pools:
+            continue
+        try:
+            replica = await asyncpg.create_pool(
+                dsn,
+                min_size=settings.db_pool_min_size,
+                max_size=replica_pool_max_size(),
+                server_settings=server_settings,
+                timeout=settings.replica_lag_check_interval
+            )
+        except Exception as e:
+            logger.warning('Replica %d is unreachable: %r', number, e)
+            continue
+        _gates[replica] = _gate(f'replica_{number}', replica_pool_max_size())
+        _replica_pools[dsn] = replica
+
+
+async def _monitor_replicas(server_settings: Dict[str, str]):
+    '''
+    A replica is fresh when it has replayed the primary's WAL position of a check made within
+    replica_max_lag_seconds. A replica cut off from the primary stops replaying and drops out
+    as soon as the primary has moved on, however long it has been since it last received WAL.
+    '''
+    global _fresh_replicas
+    # (monotonic time, primary WAL position) of the recent checks
+    positions = collections.deque()
+    while True:
+        await _connect_replicas(server_settings)
+        fresh = []
+        try:
+            now = time.monotonic()
+            positions.append((now, await _pool.fetchval(PRIMARY_LSN_QUERY, timeout=settings.replica_lag_check_interval)))
+            while positions[0][0] < now - settings.replica_max_lag_seconds:
+                positions.popleft()
+        except Exception:
+            # without the primary's position no replica can be judged, reads go to the primary
+            logger.warning('Primary WAL position check failed', exc_info=True)
+            positions.clear()
+        for replica in _replica_pools.values() if positions else []:
+            try:
+                replayed = await replica.fetchval(REPLICA_LSN_QUERY, timeout=settings.replica_lag_check_interval)
+            except Exception:
+                # a replica that can't answer (closing pool, lost connection, ...) gets no reads until it does
+                logger.warning('Replica lag check failed', exc_info=True)
+                continue
+            if replayed is not None and positions[0][1] <= replayed:
+                fresh.append(replica)
+        _fresh_replicas = fresh
+        await asyncio.sleep(settings.replica_lag_check_interval)
+
+
+def _gate(name: str, capacity: int) -> AdmissionGate:
+    return AdmissionGate(
+        name,
+        capacity=capacity,
+        max_waiting=settings.db_admission_queue,
+        max_wait=settings.db_admission_timeout
+    )
+
+
+def admission_samples():
+    for gate in _gates.values():
+        yield from gate.samples()
+
+
+async def db_pool_open():
+    global _pool, _lag_monitor
+    # the default class timeout is set at connect, RESET ALL on release returns to it
+    server_settings = {'statement_timeout': str(settings.db_statement_timeout)}
+    _pool = await asyncpg.create_pool(
+        host=settings.db_host,
+        port=settings.db_port,
+        user=settings.db_user,
+        password=settings.db_password,
+        database=settings.db_name,
+        min_size=settings.db_pool_min_size,
+        max_size=pool_max_size(),
+        server_settings=server_settings
+    )
+    # running jobs hold connections past the gate, see acquire_job_connection
+    _gates[_pool] = _gate('primary', max(1, pool_max_size() - settings.jobs_max_running))
+    if settings.db_replica_urls:
+        # replicas are connected by the monitor, one that is down must not stop the app from starting
+        _lag_monitor = asyncio.create_task(_monitor_replicas(server_settings))
+
+
+async def db_pool_close():
+    global _pool, _replica_pools, _fresh_replicas, _lag_monitor
+    if _lag_monitor is not None:
+        _lag_monitor.cancel()
+        _lag_monitor = None
+    _fresh_replicas = []
+    _gates.clear()
+    for replica in _replica_pools.values():
+        await replica.close()
+    _replica_pools = {}
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def read_pool() -> asyncpg.Pool:
+    ''' round robin over replicas within the allowed lag, the primary if there are none '''
+    replicas = _fresh_replicas
+    if not replicas:
+        return _pool
+    return replicas[next(_replica_counter) % len(replicas)]
+
+
+@asynccontextmanager
+async def _acquire(pool: asyncpg.Pool, statement_timeout: int):
+    ''' a pool connection, Overloaded if none frees up within the admission timeout '''
+    try:
+        connection = await pool.acquire(timeout=settings.db_admission_timeout)
+    except asyncio.TimeoutError:
+        raise Overloaded()
     try:
+        if statement_timeout != settings.db_statement_timeout:
+            await connection.execute(f'SET statement_timeout = {int(statement_timeout)}')
         yield connection
     finally:
-        await connection.close()
+        await pool.release(connection)
+
+
+@asynccontextmanager
+async def _admitted(pool: asyncpg.Pool, route_class: str, statement_timeout: Optional[int] = None):
+    ''' waits for an admission slot of the pool, raises Overloaded instead of queueing without limit '''
+    priority, class_timeout = ROUTE_CLASSES[route_class]
+    gate = _gates[pool]
+    await gate.enter(priority, route_class)
+    try:
+        async with _acquire(pool, class_timeout if statement_timeout is None else statement_timeout) as connection:
+            yield connection
+    finally:
+        gate.leave()
+
+
+async def get_db_connection() -> AsyncGenerator[asyncpg.Connection, None]:
+    async with _admitted(_pool, 'default') as connection:
+        yield connection
+
+
+async def get_db_priority_connection() -> AsyncGenerator[asyncpg.Connection, None]:
+    ''' short writes users wait on at the desk, admitted before everything else '''
+    async with _admitted(_pool, 'priority') as connection:
+        yield connection
+
+
+async def get_db_read_connection() -> AsyncGenerator[asyncpg.Connection, None]:
+    async with _admitted(read_pool(), 'default') as connection:
+        yield connection
+
+
+@asynccontextmanager
+async def acquire_connection(route_class: str = 'default', statement_timeout: Optional[int] = None):
+    ''' connection for code outside the request dependencies (auth, cache, job bookkeeping), admitted as well '''
+    async with _admitted(_pool, route_class, statement_timeout) as connection:
+        yield connection
+
+
+async def _replayed(connection: asyncpg.Connection, xact: str) -> bool:
+    ''' the server of the connection has the commit of the transaction, on a replica it may not yet '''
+    try:
+        return await connection.fetchval('SELECT pg_xact_status($1::text::xid8)', xact) == 'committed'
+    except asyncpg.InvalidParameterValueError:
+        # "transaction ID is in the future": the replica has not replayed that far
+        return False
+
+
+@asynccontextmanager
+async def acquire_read_connection(route_class: str = 'default', statement_timeout: Optional[int] = None,
+                                  after_xact: Optional[str] = None):
+    ''' with after_xact, a replica only if it has replayed that transaction, otherwise the primary '''
+    pool = read_pool()
+    if pool is not _pool and after_xact is not None:
+        async with _admitted(pool, route_class, statement_timeout) as connection:
+            if await _replayed(connection, after_xact):
+                yield connection
+                return
+        pool = _pool
+    async with _admitted(pool, route_class, statement_timeout) as connection:
+        yield connection
+
+
+@asynccontextmanager
+async def acquire_job_connection(statement_timeout: Optional[int] = None):
+    '''
+    Connection a running job holds for its whole run. It comes from the jobs_max_running
+    connections the primary gate leaves out, so it does not wait behind requests.
+    '''
+    if statement_timeout is None:
+        statement_timeout = settings.db_statement_timeout
+    async with _acquire(_pool, statement_timeout) as connection:
+        yield connection
 
 
 async def db_init():
     with open("sql/init.sql", "r") as file:
         sql_script = file.read()
 
-    async for connection in get_db_connection():
+    connection = await db_connect()
+    try:
         await connection.execute(sql_script)
+    finally:
+        await connection.close()
 
 
 async def db_seeder():
     with open("sql/seeder.sql", "r") as file:
         sql_script = file.read()
 
-    async for connection in get_db_connection():
+    connection = await db_connect()
+    try:
         await connection.execute(sql_script)
+    finally:
+        await connection.close()
@@ -1 +1 @@
-from .api_key import api_key_auth
\ No newline at end of file
+from .api_key import api_key_auth, api_key_read, api_key_admin
\ No newline at end of file
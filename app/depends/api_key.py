@@ -1,12 +1,34 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import APIKeyHeader
-from settings import settings
+from typing import Optional
+
+from utils.api_keys import ApiKey, api_key_cache
 
 api_key_header = APIKeyHeader(name="Api-Key")
 
-def api_key_auth(api_key: str = Depends(api_key_header)):
-    if api_key != settings.api_key:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Missing or invalid Api-Key"
-        )
\ No newline at end of file
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def require_scope(scope: Optional[str] = None):
+    ''' without a scope, reads need "read" and everything else "write" '''
+
+    async def auth(request: Request, api_key: str = Depends(api_key_header)) -> ApiKey:
+        key = await api_key_cache.verify(api_key)
+        if key is None:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Missing or invalid Api-Key"
+            )
+        needed = scope or ('read' if request.method in READ_METHODS else 'write')
+        if not key.allows(needed):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"Api-Key lacks the {needed} scope"
+            )
+        return key
+    return auth
+
+
+api_key_auth = require_scope()
+api_key_read = require_scope('read')
+api_key_admin = require_scope('admin')
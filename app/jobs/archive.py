@@ -0,0 +1,82 @@
+'''
+Moves returned borrows older than ARCHIVE_AFTER_DAYS into BorrowReturnLogsArchive.
+
+Every batch is its own short transaction and skips rows locked by other
+sessions, so the hot table never stays locked for long.
+
+    cd app && python -m jobs.archive
+'''
+from asyncpg import Connection
+import argparse
+import asyncio
+import time
+
+from database import db_connect
+from settings import settings
+
+
+ARCHIVE_BATCH_QUERY = '''
+    WITH moved AS (
+        DELETE FROM BorrowReturnLogs
+        WHERE id_borrow IN (
+            SELECT id_borrow FROM BorrowReturnLogs
+            WHERE is_returned = TRUE AND return_date < CURRENT_DATE - $1::int
+            LIMIT $2
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id_borrow, id_book, id_user, borrow_date, return_date, created_at
+    ), archived AS (
+        INSERT INTO BorrowReturnLogsArchive (id_borrow, id_book, id_user, borrow_date, return_date, created_at)
+        SELECT id_borrow, id_book, id_user, borrow_date, return_date, created_at FROM moved
+        ON CONFLICT (id_borrow) DO NOTHING
+    )
+    SELECT COUNT(*) FROM moved
+'''
+
+
+async def archive_borrows(connection: Connection, older_than_days: int = settings.archive_after_days,
+                          batch_size: int = settings.archive_batch_size, progress=None) -> dict:
+    started = time.perf_counter()
+    archived = 0
+    batches = 0
+    total = await connection.fetchval('''
+        SELECT COUNT(*) FROM BorrowReturnLogs WHERE is_returned = TRUE AND return_date < CURRENT_DATE - $1::int
+    ''', older_than_days)
+    while True:
+        moved = await connection.fetchval(ARCHIVE_BATCH_QUERY, older_than_days, batch_size)
+        archived += moved
+        batches += 1
+        if progress is not None and total:
+            await progress(min(archived / total, 1.0))
+        if moved < batch_size:
+            break
+        # yield to request handlers when running inside the app
+        await asyncio.sleep(0)
+
+    if archived:
+        # plain vacuum takes no exclusive lock and makes the freed pages reusable
+        await connection.execute('VACUUM (ANALYZE) BorrowReturnLogs')
+
+    return {
+        'archived': archived,
+        'batches': batches,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+async def main(older_than_days: int, batch_size: int):
+    connection = await db_connect()
+    try:
+        stats = await archive_borrows(connection, older_than_days, batch_size)
+    finally:
+        await connection.close()
+    for key, value in stats.items():
+        print(f'{key}: {value}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--older-than-days', type=int, default=settings.archive_after_days)
+    parser.add_argument('--batch-size', type=int, default=settings.archive_batch_size)
+    args = parser.parse_args()
+    asyncio.run(main(args.older_than_days, args.batch_size))
@@ -0,0 +1,212 @@
+'''
+Co-borrowing recommendations.
+
+Builds a sparse user x book matrix from live and archived borrows and stores, for every
+book, the top-k books whose borrowers overlap the most (cosine similarity of
+the borrower sets) in BookSimilarities.
+
+    cd app && python -m jobs.recommendations                  # full rebuild
+    cd app && python -m jobs.recommendations --incremental    # only books touched by new borrows
+
+An incremental run recomputes the neighbours of every book borrowed by a user
+with new borrows. Other books pick up the changed popularity of their
+neighbours at the next full rebuild.
+'''
+from asyncpg import Connection
+from scipy import sparse
+import argparse
+import asyncio
+import io
+import numpy as np
+import resource
+import time
+
+from database import db_connect
+from settings import settings
+from utils.borrows import borrows_source
+
+
+# rows of the book x book co-occurrence matrix computed at once, bounds memory
+CHUNK_ROWS = 4096
+# borrows committed late can carry an older created_at, so runs overlap a little
+WATERMARK_OVERLAP = '5 minutes'
+
+BOOK_INDEX = 'SELECT id_book, ROW_NUMBER() OVER (ORDER BY id_book) - 1 AS book_index FROM Books'
+
+
+async def _copy_pairs(connection: Connection, query: str, *args) -> np.ndarray:
+    ''' streams a two-column integer query result into a numpy array '''
+    output = io.BytesIO()
+    await connection.copy_from_query(query, *args, output=output, format='csv')
+    if not output.getbuffer().nbytes:
+        return np.empty((0, 2), dtype=np.int64)
+    output.seek(0)
+    return np.loadtxt(output, delimiter=',', dtype=np.int64, ndmin=2)
+
+
+def top_k_similar(pairs: np.ndarray, degrees: np.ndarray, rows: np.ndarray, n_books: int, top_k: int):
+    '''
+    pairs: (user index, book index) of distinct borrows, degrees: borrowers per book,
+    rows: book indexes to compute neighbours for.
+    Returns (book, similar book, score) arrays.
+    '''
+    sources, targets, scores = [], [], []
+    if not len(pairs) or not len(rows):
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+
+    users, books = pairs[:, 0], pairs[:, 1]
+    matrix = sparse.csc_matrix(
+        (np.ones(len(pairs), dtype=np.float32), (users, books)),
+        shape=(int(users.max()) + 1, n_books)
+    )
+    degrees = degrees.astype(np.float32)
+
+    for start in range(0, len(rows), CHUNK_ROWS):
+        chunk = rows[start:start + CHUNK_ROWS]
+        # co-borrow counts of the chunk books with every book
+        co = (matrix[:, chunk].T @ matrix).tocsr()
+        row_books = np.repeat(chunk, np.diff(co.indptr))
+        co.data /= np.sqrt(degrees[row_books] * degrees[co.indices])
+
+        for i, book in enumerate(chunk):
+            lo, hi = co.indptr[i], co.indptr[i + 1]
+            neighbours, similarity = co.indices[lo:hi], co.data[lo:hi]
+            keep = neighbours != book
+            neighbours, similarity = neighbours[keep], similarity[keep]
+            if len(neighbours) > top_k:
+                top = np.argpartition(-similarity, top_k)[:top_k]
+                neighbours, similarity = neighbours[top], similarity[top]
+            sources.append(np.full(len(neighbours), book))
+            targets.append(neighbours)
+            scores.append(similarity)
+
+    return np.concatenate(sources), np.concatenate(targets), np.concatenate(scores)
+
+
+async def build_similarities(connection: Connection, incremental: bool = False,
+                             top_k: int = settings.recommendations_top_k, progress=None) -> dict:
+    started = time.perf_counter()
+
+    # one snapshot, so book numbering is the same in every query
+    async with connection.transaction(isolation='repeatable_read', readonly=True):
+        run_started_at = await connection.fetchval('SELECT CURRENT_TIMESTAMP::timestamp')
+        book_ids = [row['id_book'] for row in await connection.fetch('SELECT id_book FROM Books ORDER BY id_book')]
+        processed_until = await connection.fetchval('SELECT processed_until FROM RecommendationState')
+
+        if incremental and processed_until is not None:
+            mode = 'incremental'
+            affected_users = f'''
+                SELECT id_user FROM BorrowReturnLogs
+                WHERE created_at > $1::timestamp - interval '{WATERMARK_OVERLAP}'
+            '''
+            pairs = await _copy_pairs(connection, f'''
+                SELECT DENSE_RANK() OVER (ORDER BY br.id_user) - 1, b.book_index
+                FROM (
+                    SELECT DISTINCT id_user, id_book FROM {borrows_source(include_archived=True)}
+                    WHERE id_user IN (
+                        SELECT id_user FROM {borrows_source(include_archived=True)} WHERE id_book IN (
+                            SELECT id_book FROM {borrows_source(include_archived=True)} WHERE id_user IN ({affected_users})
+                        )
+                    )
+                ) AS br
+                JOIN ({BOOK_INDEX}) AS b ON br.id_book = b.id_book
+            ''', processed_until)
+            rows = await _copy_pairs(connection, f'''
+                SELECT DISTINCT b.book_index, 0
+                FROM {borrows_source(include_archived=True, alias='br')}
+                JOIN ({BOOK_INDEX}) AS b ON br.id_book = b.id_book
+                WHERE br.id_user IN ({affected_users})
+            ''', processed_until)
+            rows = rows[:, 0]
+            degree_pairs = await _copy_pairs(connection, f'''
+                SELECT b.book_index, COUNT(DISTINCT br.id_user)
+                FROM {borrows_source(include_archived=True, alias='br')}
+                JOIN ({BOOK_INDEX}) AS b ON br.id_book = b.id_book
+                GROUP BY b.book_index
+            ''')
+            degrees = np.zeros(len(book_ids), dtype=np.int64)
+            degrees[degree_pairs[:, 0]] = degree_pairs[:, 1]
+        else:
+            mode = 'full'
+            pairs = await _copy_pairs(connection, f'''
+                SELECT DENSE_RANK() OVER (ORDER BY br.id_user) - 1, b.book_index
+                FROM (SELECT DISTINCT id_user, id_book FROM {borrows_source(include_archived=True)}) AS br
+                JOIN ({BOOK_INDEX}) AS b ON br.id_book = b.id_book
+            ''')
+            rows = np.arange(len(book_ids))
+            degrees = np.bincount(pairs[:, 1], minlength=len(book_ids))
+    loaded = time.perf_counter()
+    if progress is not None:
+        await progress(0.3)
+
+    sources, targets, scores = await asyncio.to_thread(
+        top_k_similar, pairs, degrees, rows, len(book_ids), top_k
+    )
+    computed = time.perf_counter()
+    if progress is not None:
+        await progress(0.7)
+
+    async with connection.transaction():
+        # staged first, so books deleted while computing are skipped instead of breaking the FK
+        await connection.execute('''
+            CREATE TEMPORARY TABLE SimilaritiesStaging (
+                id_book UUID NOT NULL, id_similar UUID NOT NULL, score REAL NOT NULL
+            ) ON COMMIT DROP
+        ''')
+        for start in range(0, len(sources), 100_000):
+            end = start + 100_000
+            await connection.copy_records_to_table('similaritiesstaging', records=[
+                (book_ids[source], book_ids[target], float(score))
+                for source, target, score in zip(sources[start:end], targets[start:end], scores[start:end])
+            ])
+
+        if mode == 'full':
+            await connection.execute('DELETE FROM BookSimilarities')
+        else:
+            await connection.execute(
+                'DELETE FROM BookSimilarities WHERE id_book = ANY($1::uuid[])', [book_ids[row] for row in rows]
+            )
+        await connection.execute('''
+            INSERT INTO BookSimilarities (id_book, id_similar, score)
+            SELECT s.id_book, s.id_similar, s.score
+            FROM SimilaritiesStaging s
+            JOIN Books b ON s.id_book = b.id_book
+            JOIN Books sb ON s.id_similar = sb.id_book
+        ''')
+        await connection.execute('''
+            INSERT INTO RecommendationState (id, processed_until) VALUES (1, $1)
+            ON CONFLICT (id) DO UPDATE SET processed_until = EXCLUDED.processed_until
+        ''', run_started_at)
+    finished = time.perf_counter()
+
+    return {
+        'mode': mode,
+        'borrow_pairs': len(pairs),
+        'books': len(book_ids),
+        'updated_books': len(rows),
+        'similarities': len(sources),
+        'load_seconds': round(loaded - started, 3),
+        'compute_seconds': round(computed - loaded, 3),
+        'write_seconds': round(finished - computed, 3),
+        'total_seconds': round(finished - started, 3),
+        # ru_maxrss is in kilobytes on linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+async def main(incremental: bool, top_k: int):
+    connection = await db_connect()
+    try:
+        stats = await build_similarities(connection, incremental=incremental, top_k=top_k)
+    finally:
+        await connection.close()
+    for key, value in stats.items():
+        print(f'{key}: {value}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--top-k', type=int, default=settings.recommendations_top_k)
+    args = parser.parse_args()
+    asyncio.run(main(args.incremental, args.top_k))
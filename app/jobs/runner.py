@@ -0,0 +1,273 @@
+import asyncio
+import inspect
+import json
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from database import acquire_connection, acquire_job_connection
+from settings import settings
+from routes.reports import (get_availableable_books, get_users_total_borrowed_books,
+                            get_users_current_borrowed_books, get_users_last_visit,
+                            get_users_borrowed_books, get_fine_borrows, get_borrowed_users_geo)
+from .recommendations import build_similarities
+from .archive import archive_borrows
+from .search import reindex_books
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'jobs'
+
+Progress = Callable[[float], Awaitable[None]]
+
+REPORTS = {
+    'books/available': get_availableable_books,
+    'books/users/all': get_users_total_borrowed_books,
+    'books/users/current': get_users_current_borrowed_books,
+    'visit/last': get_users_last_visit,
+    'genres/popular': get_users_borrowed_books,
+    'borrows/fine': get_fine_borrows,
+    'borrows/geo': get_borrowed_users_geo,
+}
+
+
+# statement_timeout=0: the request timeouts do not apply to jobs
+async def _recommendations(params: dict, progress: Progress) -> dict:
+    async with acquire_job_connection(statement_timeout=0) as connection:
+        return await build_similarities(
+            connection,
+            incremental=params.get('incremental', False),
+            top_k=params.get('top_k', settings.recommendations_top_k),
+            progress=progress
+        )
+
+
+async def _archive(params: dict, progress: Progress) -> dict:
+    async with acquire_job_connection(statement_timeout=0) as connection:
+        return await archive_borrows(
+            connection,
+            older_than_days=params.get('older_than_days', settings.archive_after_days),
+            batch_size=params.get('batch_size', settings.archive_batch_size),
+            progress=progress
+        )
+
+
+async def _search_reindex(params: dict, progress: Progress) -> dict:
+    async with acquire_job_connection(statement_timeout=0) as connection:
+        return await reindex_books(connection, batch_size=params.get('batch_size', 1000), progress=progress)
+
+
+async def _report(params: dict, progress: Progress) -> dict:
+    # the report query itself, not the cached endpoint: a job is not held to the request timeouts
+    handler = REPORTS[params['name']].__wrapped__
+    kwargs = {
+        name: params.get(name, getattr(parameter.default, 'default', parameter.default))
+        for name, parameter in inspect.signature(handler).parameters.items()
+        if name != 'connection'
+    }
+    async with acquire_job_connection(statement_timeout=0) as connection:
+        return await handler(connection=connection, **kwargs)
+
+
+# job type -> seconds between the runs the runners queue themselves, 0 for none
+SCHEDULES = {
+    'archive': settings.archive_interval_hours * 3600,
+}
+SCHEDULE_CHECK_SECONDS = 60
+
+
+# job type -> (function, how many may run at once in one worker)
+JOB_TYPES = {
+    'recommendations': (_recommendations, 1),
+    'archive': (_archive, 1),
+    'search_reindex': (_search_reindex, 1),
+    'report': (_report, 2),
+}
+
+
+class JobRunner:
+    '''
+    Runs queued jobs inside the app process. Jobs are claimed with SKIP LOCKED,
+    so every worker can run a runner. jobs_max_running and the per-type limits
+    cap the pool connections jobs take away from interactive requests.
+    '''
+
+    def __init__(self):
+        self._loop_task: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._running: Dict[str, int] = {job_type: 0 for job_type in JOB_TYPES}
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._next_schedule_check = 0.0
+
+    def on_notify(self, payload: str):
+        self._wakeup.set()
+
+    async def start(self):
+        self._loop_task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        self._stopping = True
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        if self._tasks:
+            # unfinished jobs are put back in the queue by _run
+            _, pending = await asyncio.wait(self._tasks, timeout=settings.jobs_shutdown_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def _free_types(self):
+        if sum(self._running.values()) >= settings.jobs_max_running:
+            return []
+        return [job_type for job_type, (_, limit) in JOB_TYPES.items() if self._running[job_type] < limit]
+
+    async def _claim(self):
+        free_types = self._free_types()
+        if not free_types:
+            return None
+        async with acquire_connection() as connection:
+            # jobs whose worker kept dying under them are given up on
+            await connection.execute('''
+                UPDATE Jobs
+                SET status = 'failed', error = 'Gave up after ' || attempts || ' attempts',
+                    finished_at = CURRENT_TIMESTAMP
+                WHERE id_job IN (
+                    SELECT id_job FROM Jobs
+                    WHERE attempts >= $1
+                        AND (status = 'queued' OR (
+                            status = 'running' AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => $2)
+                        ))
+                    FOR UPDATE SKIP LOCKED
+                )
+            ''', settings.jobs_max_attempts, settings.jobs_lease_seconds)
+            return await connection.fetchrow('''
+                UPDATE Jobs
+                SET status = 'running', started_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+                WHERE id_job = (
+                    SELECT id_job FROM Jobs
+                    WHERE job_type = ANY($1::varchar[])
+                        AND attempts < $3
+                        AND (status = 'queued' OR (
+                            status = 'running' AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => $2)
+                        ))
+                    ORDER BY created_at
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id_job, job_type, params
+            ''', free_types, settings.jobs_lease_seconds, settings.jobs_max_attempts)
+
+    async def _schedule(self):
+        ''' queues each scheduled job whose last run was queued longer ago than its interval '''
+        async with acquire_connection() as connection:
+            async with connection.transaction():
+                # workers decide one at a time, the next one sees the job the previous one queued
+                await connection.execute("SELECT pg_advisory_xact_lock(hashtext('jobs_schedule'))")
+                for job_type, interval in SCHEDULES.items():
+                    if interval <= 0:
+                        continue
+                    id_job = await connection.fetchval('''
+                        INSERT INTO Jobs (job_type)
+                        SELECT $1::varchar
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM Jobs
+                            WHERE job_type = $1 AND created_at > CURRENT_TIMESTAMP - make_interval(secs => $2)
+                        ) AND NOT EXISTS (
+                            SELECT 1 FROM Jobs WHERE job_type = $1 AND status IN ('queued', 'running')
+                        )
+                        RETURNING id_job
+                    ''', job_type, interval)
+                    if id_job is not None:
+                        logger.info('Scheduled %s job %s', job_type, id_job)
+                        await connection.execute('SELECT pg_notify($1, $2)', CHANNEL, str(id_job))
+
+    async def _loop(self):
+        while True:
+            if time.monotonic() >= self._next_schedule_check:
+                self._next_schedule_check = time.monotonic() + SCHEDULE_CHECK_SECONDS
+                try:
+                    await self._schedule()
+                except Exception:
+                    logger.exception('Scheduling jobs failed')
+
+            try:
+                job = await self._claim()
+            except Exception:
+                logger.exception('Claiming a job failed')
+                job = None
+
+            if job is not None:
+                self._running[job['job_type']] += 1
+                task = asyncio.create_task(self._run(job))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.jobs_poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _update(self, id_job, query: str, *args):
+        # short bookkeeping writes, admitted ahead of requests so a busy pool does not starve the heartbeat
+        async with acquire_connection('priority') as connection:
+            await connection.execute(query, id_job, *args)
+
+    async def _heartbeat(self, id_job, job_task: asyncio.Task):
+        interval = settings.jobs_lease_seconds / 3
+        renewed = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._update(id_job, 'UPDATE Jobs SET updated_at = CURRENT_TIMESTAMP WHERE id_job = $1')
+                renewed = time.monotonic()
+            except Exception:
+                logger.exception('Heartbeat of job %s failed', id_job)
+                # the lease runs out before the next beat, another worker would run the job a second time
+                if time.monotonic() + interval >= renewed + settings.jobs_lease_seconds:
+                    logger.error('Job %s lost its lease, stopping it', id_job)
+                    job_task.cancel()
+                    return
+
+    async def _run(self, job):
+        id_job = job['id_job']
+        function, _ = JOB_TYPES[job['job_type']]
+
+        async def progress(value: float):
+            # progress is informational, a busy pool must not fail the job
+            try:
+                await self._update(id_job, 'UPDATE Jobs SET progress = $2 WHERE id_job = $1', value)
+            except Exception:
+                logger.warning('Progress of job %s not saved', id_job, exc_info=True)
+
+        heartbeat = asyncio.create_task(self._heartbeat(id_job, asyncio.current_task()))
+        try:
+            result = await function(json.loads(job['params']), progress)
+        except asyncio.CancelledError:
+            # a job interrupted by shutdown does not use up an attempt, one that lost its lease does
+            await self._update(id_job, '''
+                UPDATE Jobs SET status = 'queued', attempts = attempts - $2::int WHERE id_job = $1
+            ''', int(self._stopping))
+            raise
+        except Exception as e:
+            logger.exception('Job %s failed', id_job)
+            await self._update(id_job, '''
+                UPDATE Jobs SET status = 'failed', error = $2, finished_at = CURRENT_TIMESTAMP WHERE id_job = $1
+            ''', str(e))
+        else:
+            await self._update(id_job, '''
+                UPDATE Jobs SET status = 'done', progress = 1, result = $2, finished_at = CURRENT_TIMESTAMP
+                WHERE id_job = $1
+            ''', json.dumps(result, default=str))
+        finally:
+            heartbeat.cancel()
+            self._running[job['job_type']] -= 1
+            self._wakeup.set()
+
+
+job_runner = JobRunner()
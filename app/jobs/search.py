@@ -0,0 +1,56 @@
+'''
+Rebuilds the search documents of all books in batches.
+
+    cd app && python -m jobs.search
+'''
+from asyncpg import Connection
+import argparse
+import asyncio
+import time
+
+from database import db_connect
+
+
+async def reindex_books(connection: Connection, batch_size: int = 1000, progress=None) -> dict:
+    started = time.perf_counter()
+    total = await connection.fetchval('SELECT COUNT(*) FROM Books')
+    reindexed = 0
+    last_id = None
+    while True:
+        book_ids = await connection.fetchval('''
+            SELECT ARRAY(
+                SELECT id_book FROM Books
+                WHERE $1::uuid IS NULL OR id_book > $1
+                ORDER BY id_book
+                LIMIT $2
+            )
+        ''', last_id, batch_size)
+        if not book_ids:
+            break
+        await connection.execute('SELECT refresh_book_search($1::uuid[])', book_ids)
+        reindexed += len(book_ids)
+        last_id = book_ids[-1]
+        if progress is not None and total:
+            await progress(min(reindexed / total, 1.0))
+
+    return {
+        'reindexed': reindexed,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+async def main(batch_size: int):
+    connection = await db_connect()
+    try:
+        stats = await reindex_books(connection, batch_size)
+    finally:
+        await connection.close()
+    for key, value in stats.items():
+        print(f'{key}: {value}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size))
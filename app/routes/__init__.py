@@ -3,4 +3,10 @@ from .users import user_router
 from .books import book_router
 from .genre import genre_router
 from .authors import author_router
-from .reports import reports_router
\ No newline at end of file
+from .reports import reports_router
+from .autocomplete import autocomplete_router
+from .batch import batch_router
+from .health import health_router
+from .metrics import metrics_router
+from .jobs import jobs_router
+from .api_keys import api_keys_router
\ No newline at end of file
@@ -0,0 +1,59 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from asyncpg import Connection
+import uuid
+
+from depends import api_key_admin
+from database import get_db_connection
+from schemas import ApiKeyCreate
+from utils.api_keys import api_key_cache
+
+
+api_keys_router = APIRouter(
+    prefix='/keys',
+    tags=['Authorization']
+)
+
+
+@api_keys_router.get('', dependencies=[Depends(api_key_admin)])
+async def get_api_keys(
+    client: str = Query(None),
+    connection: Connection = Depends(get_db_connection)
+):
+    query = '''
+        SELECT id_key, client, scopes, expires_at, revoked_at, created_at
+        FROM ApiKeys
+        WHERE $1::varchar IS NULL OR client = $1
+        ORDER BY created_at
+    '''
+    return {
+        'keys': await connection.fetch(query, client)
+    }
+
+
+@api_keys_router.post('', dependencies=[Depends(api_key_admin)])
+async def create_api_key(
+    key: ApiKeyCreate,
+    connection: Connection = Depends(get_db_connection)
+):
+    expires_in = None if key.expires_in_days is None else key.expires_in_days * 86400
+    id_key, api_key = await api_key_cache.create(connection, key.client, key.scopes, expires_in)
+
+    return {
+        'id_key': id_key,
+        # shown only once, only the hash is stored
+        'api_key': api_key,
+        'scopes': key.scopes
+    }
+
+
+@api_keys_router.delete('/id', dependencies=[Depends(api_key_admin)])
+async def revoke_api_key(
+    id_key: uuid.UUID = Query(description='uuid'),
+    connection: Connection = Depends(get_db_connection)
+):
+    if not await api_key_cache.revoke(connection, id_key):
+        raise HTTPException(status_code=404, detail='Key not found or already revoked')
+
+    return {
+        'status': 'revoked'
+    }
@@ -1,6 +1,12 @@
-from fastapi import APIRouter, HTTPException, Body
+from fastapi import APIRouter, HTTPException, Body, Depends
+from asyncpg import Connection
+import asyncio
+
+from database import get_db_connection
 from schemas import SuccessLogin
 from settings import settings
+from utils.api_keys import api_key_cache, delete_expired_keys
+from utils.passwords import verify_password, DUMMY_HASH
 
 
 auth_router = APIRouter(
@@ -13,8 +19,20 @@ auth_router = APIRouter(
 async def login(
     login: str = Body(),
     password: str = Body(),
+    connection: Connection = Depends(get_db_connection)
 ):
-    if login != settings.api_user or password != settings.api_password:
+    user = await connection.fetchrow('SELECT password_hash, scopes FROM ApiUsers WHERE login = $1', login)
+    # an unknown login is checked against a dummy hash, so it takes as long as a wrong password
+    password_hash = DUMMY_HASH if user is None else user['password_hash']
+    # scrypt is slow on purpose, keep it off the event loop
+    valid = await asyncio.to_thread(verify_password, password, password_hash)
+    if user is None or not valid:
         raise HTTPException(status_code=401, detail='Incorrect login or password')
-    
-    return SuccessLogin(status='success', api_key=settings.api_key)
\ No newline at end of file
+
+    # every login issues a key, the expired ones are removed here so the table does not grow
+    async with connection.transaction():
+        await delete_expired_keys(connection)
+        _, api_key = await api_key_cache.create(
+            connection, login, list(user['scopes']), settings.login_key_ttl_hours * 3600
+        )
+    return SuccessLogin(status='success', api_key=api_key)
@@ -3,8 +3,9 @@ from asyncpg import Connection
 import uuid
 
 from depends import api_key_auth
-from database import get_db_connection
+from database import get_db_connection, get_db_read_connection
 from schemas import AuthorCreate, AuthorEdit
+from utils import autocomplete_index, report_cache, coalesce
 
 
 author_router = APIRouter(
@@ -20,6 +21,7 @@ async def create_author(
 ):
     query = "INSERT INTO Authors (author_name) VALUES ($1) RETURNING id_author"
     new_author_id = await connection.fetchval(query, author.author_name)
+    await autocomplete_index.publish(connection, 'authors', new_author_id, author.author_name)
     return {
         "status": "success", 
         'id_author': new_author_id
@@ -27,11 +29,12 @@ async def create_author(
 
 
 @author_router.get('', dependencies=[Depends(api_key_auth)])
+@coalesce('authors')
 async def get_authors(
     offset: int = Query(0, ge=0),
     limit: int = Query(10, gt=0),
     desc: bool = Query(False, description="Sort in descending order"),
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(get_db_read_connection)
 ):
     order_by = ' DESC' if desc else ' ASC'
     query = f"SELECT id_author, author_name FROM Authors ORDER BY author_name {order_by}"
@@ -51,9 +54,10 @@ async def get_authors(
 
 
 @author_router.get('/id', dependencies=[Depends(api_key_auth)])
+@coalesce('authors/id')
 async def get_author(
     id_author: uuid.UUID,
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(get_db_read_connection)
 ):
     query = "SELECT id_author, author_name FROM Authors WHERE id_author = $1 LIMIT 1"
     author = await connection.fetchrow(query, id_author)
@@ -68,8 +72,15 @@ async def delete_author(
     id_author: uuid.UUID,
     connection: Connection = Depends(get_db_connection)
 ):
-    delete_query = 'DELETE FROM Authors WHERE id_author = $1'
-    await connection.execute(delete_query, id_author)
+    async with connection.transaction():
+        book_ids = await connection.fetchval(
+            'SELECT ARRAY(SELECT id_book FROM BookAuthors WHERE id_author = $1)', id_author
+        )
+        delete_query = 'DELETE FROM Authors WHERE id_author = $1'
+        await connection.execute(delete_query, id_author)
+        await connection.execute('SELECT refresh_book_search($1::uuid[])', book_ids)
+    await autocomplete_index.publish(connection, 'authors', id_author)
+    await report_cache.invalidate(connection)
     
     return {"status": "success"}
 
@@ -80,8 +91,14 @@ async def update_author(
     author: AuthorEdit,
     connection: Connection = Depends(get_db_connection)
 ):
-    query = "UPDATE Authors SET author_name = $1 WHERE id_author = $2"
-    await connection.execute(query, author.author_name, id_author)
+    async with connection.transaction():
+        query = "UPDATE Authors SET author_name = $1 WHERE id_author = $2"
+        await connection.execute(query, author.author_name, id_author)
+        await connection.execute(
+            'SELECT refresh_book_search(ARRAY(SELECT id_book FROM BookAuthors WHERE id_author = $1))', id_author
+        )
+    await autocomplete_index.publish(connection, 'authors', id_author, author.author_name)
+    await report_cache.invalidate(connection)
     return {
         'status': 'success',
         'id_author': id_author 
@@ -0,0 +1,29 @@
+from fastapi import APIRouter, Depends, Query
+from typing import List, Literal
+
+from depends import api_key_auth
+from utils import autocomplete_index
+
+
+autocomplete_router = APIRouter(
+    prefix='/autocomplete',
+    tags=['Autocomplete']
+)
+
+
+@autocomplete_router.get('', dependencies=[Depends(api_key_auth)])
+async def autocomplete(
+    q: str = Query(min_length=1, max_length=255),
+    kinds: List[Literal['books', 'authors', 'genres', 'users']] = Query(['books', 'authors', 'genres', 'users']),
+    limit: int = Query(10, gt=0, le=50),
+):
+    return {
+        'suggestions': autocomplete_index.search(q, kinds, limit)
+    }
+
+
+@autocomplete_router.get('/stats', dependencies=[Depends(api_key_auth)])
+async def autocomplete_stats():
+    return {
+        'indexes': autocomplete_index.stats()
+    }
@@ -0,0 +1,115 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.encoders import jsonable_encoder
+from asyncpg import Connection, IntegrityConstraintViolationError
+from pydantic import ValidationError
+import re
+
+from depends import api_key_auth
+from database import get_db_priority_connection
+from schemas import (BatchOperations, BatchIds, UserByPhoneParams,
+                     BookStatusParams, AddBorrowsParams, BorrowStatusParams, BookBorrow)
+from utils.batch import fetch_books, fetch_borrows, in_request_order
+from .users import get_user_by_phone
+from .books import get_book_status_by_id, add_borrows, change_borrow_status
+
+
+batch_router = APIRouter(
+    prefix='/batch',
+    tags=['Batch']
+)
+
+
+async def _get_books(connection: Connection, params: BatchIds):
+    books, not_found = in_request_order(params.ids, await fetch_books(connection, params.ids))
+    return {'books': books, 'not_found': not_found}
+
+
+async def _get_borrows(connection: Connection, params: BatchIds):
+    borrows, not_found = in_request_order(params.ids, await fetch_borrows(connection, params.ids))
+    return {'borrows': borrows, 'not_found': not_found}
+
+
+# op -> (params model, handler running on the shared connection)
+OPERATIONS = {
+    'get_user_by_phone': (
+        UserByPhoneParams,
+        lambda connection, params: get_user_by_phone(phone_number=params.phone_number, connection=connection)
+    ),
+    'get_book_status': (
+        BookStatusParams,
+        lambda connection, params: get_book_status_by_id(id_book=params.id_book, connection=connection)
+    ),
+    'get_books': (BatchIds, _get_books),
+    'get_borrows': (BatchIds, _get_borrows),
+    'add_borrows': (
+        AddBorrowsParams,
+        lambda connection, params: add_borrows(
+            id_user=params.id_user,
+            books_borrows=BookBorrow(**params.model_dump(exclude={'id_user'})),
+            connection=connection
+        )
+    ),
+    'change_borrow_status': (
+        BorrowStatusParams,
+        lambda connection, params: change_borrow_status(
+            id_borrow=params.id_borrow, status=params.status, connection=connection
+        )
+    ),
+}
+
+REFERENCE = re.compile(r'^\$(\d+)((?:\.\w+)*)$')
+
+
+def _resolve(value, results: list):
+    ''' replaces "$<index>.<key>..." with a value taken from an earlier result '''
+    if isinstance(value, list):
+        return [_resolve(item, results) for item in value]
+    if not isinstance(value, str):
+        return value
+    match = REFERENCE.match(value)
+    if match is None:
+        return value
+    index = int(match.group(1))
+    if index >= len(results):
+        raise ValueError(f'{value} refers to an operation that has not run yet')
+    resolved = results[index]
+    for key in match.group(2).split('.')[1:]:
+        if isinstance(resolved, list) and key.isdigit() and int(key) < len(resolved):
+            resolved = resolved[int(key)]
+        elif isinstance(resolved, dict) and key in resolved:
+            resolved = resolved[key]
+        else:
+            raise ValueError(f'{value} does not exist in the result of operation {index}')
+    return resolved
+
+
+# the front desk checkout, admitted with the standalone borrow writes
+@batch_router.post('', dependencies=[Depends(api_key_auth)])
+async def run_batch(
+    batch: BatchOperations,
+    connection: Connection = Depends(get_db_priority_connection)
+):
+    results = []
+    async with connection.transaction():
+        for index, operation in enumerate(batch.operations):
+            params_model, handler = OPERATIONS[operation.op]
+            try:
+                params = params_model(**{
+                    key: _resolve(value, results) for key, value in operation.params.items()
+                })
+                results.append(jsonable_encoder(await handler(connection, params)))
+            except ValidationError as e:
+                error = e.errors(include_url=False, include_context=False)
+                raise HTTPException(status_code=422, detail={'index': index, 'op': operation.op, 'error': error})
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail={'index': index, 'op': operation.op, 'error': str(e)})
+            except HTTPException as e:
+                raise HTTPException(status_code=e.status_code, detail={'index': index, 'op': operation.op, 'error': e.detail})
+            # only constraint violations are the client's conflict, timeouts and server errors reach the 503 handlers
+            except IntegrityConstraintViolationError as e:
+                raise HTTPException(status_code=409, detail={'index': index, 'op': operation.op, 'error': str(e)})
+
+    return {
+        'status': 'success',
+        'results': results
+    }
@@ -1,12 +1,17 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
-from asyncpg import Connection
+from asyncpg import Connection, UniqueViolationError
 from typing import List, Optional
 import uuid
 import json
+import re
 
-from depends import api_key_auth
-from schemas import BookCreate, BookUpdate, BookBorrow
-from database import get_db_connection
+from settings import settings
+from depends import api_key_auth, api_key_read
+from schemas import BookCreate, BookUpdate, BookBorrow, BatchIds
+from database import get_db_connection, get_db_read_connection, get_db_priority_connection
+from utils import autocomplete_index, report_cache, coalesce
+from utils.batch import fetch_books, fetch_users, fetch_borrows, in_request_order
+from utils.borrows import borrows_source, book_is_out
 
 
 book_router = APIRouter(
@@ -20,21 +25,9 @@ async def get_book_status_by_id(
     id_book: uuid.UUID,
     connection: Connection = Depends(get_db_connection)
 ):
-    query = '''
-        SELECT BookDetails.id_book, title, authors, genres, COALESCE(last_borrow.is_returned, TRUE) as is_available FROM BookDetails
-        LEFT JOIN (
-            SELECT 
-                br.id_book, 
-                return_date, 
-                is_returned, 
-                id_user
-            FROM BorrowReturnLogs br
-            WHERE (br.id_book, br.return_date) IN (
-                SELECT id_book, MAX(return_date)
-                FROM BorrowReturnLogs
-                GROUP BY id_book
-            )
-        ) AS last_borrow ON BookDetails.id_book = last_borrow.id_book
+    query = f'''
+        SELECT BookDetails.id_book, title, authors, genres, NOT {book_is_out('BookDetails.id_book')} AS is_available
+        FROM BookDetails
         WHERE BookDetails.id_book = $1
     '''
     book = await connection.fetchrow(query, id_book)
@@ -51,69 +44,47 @@ async def get_book_status_by_id(
 
 
 @book_router.get('/status', dependencies=[Depends(api_key_auth)])
+@coalesce('books/status')
 async def get_books_by_status(
     status: bool = True,
     desc: bool = Query(True),
     offset: int = Query(0, ge=0),
     limit: int = Query(10, gt=0),
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(get_db_read_connection)
 ):
     order_by = "DESC" if desc else "ASC"
     query = f'''
-        SELECT BookDetails.id_book, title, authors, genres, 
-        COALESCE(last_borrow.is_returned, TRUE) as is_available
-        FROM BookDetails 
-        LEFT JOIN (
-            SELECT 
-                br.id_book, 
-                return_date, 
-                is_returned, 
-                id_user
-            FROM BorrowReturnLogs br
-            WHERE (br.id_book, br.return_date) IN (
-                SELECT id_book, MAX(return_date)
-                FROM BorrowReturnLogs
-                GROUP BY id_book
-            )
-        ) AS last_borrow ON BookDetails.id_book = last_borrow.id_book
-        WHERE COALESCE(last_borrow.is_returned, TRUE) = $1
+        SELECT id_book FROM Books
+        WHERE {'NOT ' if status else ''}{book_is_out('Books.id_book')}
         ORDER BY title {order_by}
-        OFFSET $2 LIMIT $3;
+        OFFSET $1 LIMIT $2
     '''
-    
-    books = await connection.fetch(query, status, offset, limit)
-    result = []
-    for book in books:
-        book_dict = dict(book)
-        book_dict['authors'] = json.loads(book_dict['authors'])
-        book_dict['genres'] = json.loads(book_dict['genres'])
-        result.append(book_dict)
+    ids = [row['id_book'] for row in await connection.fetch(query, offset, limit)]
+    books = await fetch_books(connection, ids)
+    # a book deleted after the ids were read is left out
+    result = [{**books[id_book], 'is_available': status} for id_book in ids if id_book in books]
 
+    # every open borrow is a different book that is out; counting all books would read the
+    # whole table, the available total is the planner's row estimate minus the books out
     total_count_query = '''
-        SELECT COUNT(*)
-        FROM BookDetails 
-        LEFT JOIN (
-            SELECT br.id_book, br.return_date, br.is_returned, br.id_user
-            FROM BorrowReturnLogs br
-            WHERE (br.id_book, br.return_date) IN (
-                SELECT id_book, MAX(return_date)
-                FROM BorrowReturnLogs
-                GROUP BY id_book
-            )
-        ) AS last_borrow ON BookDetails.id_book = last_borrow.id_book
-        WHERE COALESCE(last_borrow.is_returned, TRUE) = $1
+        SELECT CASE
+            WHEN $1 THEN GREATEST((SELECT reltuples FROM pg_class WHERE oid = 'books'::regclass)::bigint - out_books.count, 0)
+            ELSE out_books.count
+        END
+        FROM (SELECT COUNT(*) AS count FROM BorrowReturnLogs WHERE is_returned = FALSE) AS out_books
     '''
     total_count = await connection.fetchval(total_count_query, status)
     
     return {
         'books': result,
-        'next_from': None if len(books) < limit else offset + limit,
+        'next_from': None if len(ids) < limit else offset + limit,
         'total_count': total_count,
         'total_pages': (total_count + limit - 1) // limit
     }
 
 
 @book_router.get('', dependencies=[Depends(api_key_auth)])
+@coalesce('books')
 async def get_books(
     id_genre: Optional[str] = None,
     id_author: Optional[str] = None,
@@ -121,7 +92,7 @@ async def get_books(
     limit: int = Query(10, gt=0),
     sort_by: str = Query("", regex="^(|title$)"),
     desc: bool = Query(False),
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(get_db_read_connection)
 ):
     query = "SELECT id_book, title, authors, genres FROM BookDetails"
     total_count_query = '''SELECT COUNT(*) FROM BookDetails'''
@@ -166,10 +137,88 @@ async def get_books(
     }
 
 
+# pg_trgm splits words into three letter trigrams
+MIN_PREFIX = 3
+
+
+@book_router.get('/search', dependencies=[Depends(api_key_auth)])
+@coalesce('books/search')
+async def search_books(
+    q: str = Query(min_length=1, max_length=255),
+    id_genre: Optional[uuid.UUID] = None,
+    id_author: Optional[uuid.UUID] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(10, gt=0),
+    connection: Connection = Depends(get_db_read_connection)
+):
+    # every word is matched as a prefix: "tol war" -> "tol:* & war:*"; shorter words than a
+    # trigram would match most of the catalogue as a prefix, they have to match a whole word
+    words = re.findall(r'\w+', q.lower())
+    if not words:
+        return {'books': [], 'next_from': None, 'total_count': 0, 'total_pages': 0}
+    ts_query = ' & '.join(f'{word}:*' if len(word) >= MIN_PREFIX else word for word in words)
+
+    # each kind of match contributes at most search_max_candidates books, ranked where they are
+    # found: the work per search, and its total_count, stay bounded however common the words are
+    rank = "ts_rank_cd(b.search_vector, to_tsquery('simple', $2)) + word_similarity($1, b.title)"
+    args = [q, ts_query, offset, limit, settings.search_max_candidates]
+    # only the filters asked for, so the planner can start from the few books of an author
+    filters = ''
+    if id_genre is not None:
+        args.append(id_genre)
+        filters += f' AND b.id_book IN (SELECT id_book FROM BookGenres WHERE id_genre = ${len(args)})'
+    if id_author is not None:
+        args.append(id_author)
+        filters += f' AND b.id_book IN (SELECT id_book FROM BookAuthors WHERE id_author = ${len(args)})'
+    # search_vector holds the author names too, the fuzzy matches are there for misspelled words:
+    # they read the index entries of every trigram in q and run only when no word matched as typed
+    query = f'''
+        WITH words AS MATERIALIZED (
+            SELECT b.id_book, b.title, {rank} AS rank
+            FROM Books b WHERE b.search_vector @@ to_tsquery('simple', $2) {filters}
+            LIMIT $5
+        ),
+        candidates AS (
+            SELECT * FROM words
+            UNION
+            (SELECT b.id_book, b.title, {rank} AS rank
+            FROM Books b
+            WHERE char_length($1) >= {MIN_PREFIX} AND NOT EXISTS (SELECT 1 FROM words)
+                AND $1 <% b.title {filters}
+            LIMIT $5)
+            UNION
+            (SELECT b.id_book, b.title, {rank} AS rank
+            FROM Authors a
+            JOIN BookAuthors ba ON a.id_author = ba.id_author
+            JOIN Books b ON ba.id_book = b.id_book
+            WHERE char_length($1) >= {MIN_PREFIX} AND NOT EXISTS (SELECT 1 FROM words)
+                AND $1 <% a.author_name {filters}
+            LIMIT $5)
+        )
+        SELECT id_book, rank, COUNT(*) OVER () AS total_count
+        FROM candidates
+        ORDER BY rank DESC, title ASC
+        OFFSET $3 LIMIT $4
+    '''
+    ranked = await connection.fetch(query, *args)
+    total_count = ranked[0]['total_count'] if ranked else 0
+
+    books = await fetch_books(connection, [row['id_book'] for row in ranked])
+    result = [{**books[row['id_book']], 'rank': row['rank']} for row in ranked if row['id_book'] in books]
+
+    return {
+        'books': result,
+        'next_from': None if offset + limit >= total_count else offset + limit,
+        'total_count': total_count,
+        'total_pages': (total_count + limit - 1) // limit
+    }
+
+
 @book_router.get('/id', dependencies=[Depends(api_key_auth)])
+@coalesce('books/id')
 async def get_book(
     id_book: uuid.UUID,
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(get_db_read_connection)
 ):
     query = '''
         SELECT id_book, title, authors, genres FROM BookDetails WHERE id_book = $1
@@ -187,6 +236,41 @@ async def get_book(
     return {'book': None}
 
 
+@book_router.get('/id/similar', dependencies=[Depends(api_key_auth)])
+@coalesce('books/id/similar')
+async def get_similar_books(
+    id_book: uuid.UUID,
+    limit: int = Query(10, gt=0, le=settings.recommendations_top_k),
+    connection: Connection = Depends(get_db_read_connection)
+):
+    query = '''
+        SELECT s.id_similar AS id_book, b.title, s.score
+        FROM BookSimilarities s
+        JOIN Books b ON s.id_similar = b.id_book
+        WHERE s.id_book = $1
+        ORDER BY s.score DESC
+        LIMIT $2
+    '''
+    books = await connection.fetch(query, id_book, limit)
+
+    return {
+        'books': books
+    }
+
+
+@book_router.post('/batch', dependencies=[Depends(api_key_read)])
+async def get_books_batch(
+    batch: BatchIds,
+    connection: Connection = Depends(get_db_read_connection)
+):
+    books, not_found = in_request_order(batch.ids, await fetch_books(connection, batch.ids))
+    
+    return {
+        'books': books,
+        'not_found': not_found
+    }
+
+
 @book_router.delete('/id', dependencies=[Depends(api_key_auth)])
 async def delete_book(
     id_book: uuid.UUID,
@@ -194,6 +278,8 @@ async def delete_book(
 ):
     delete_query = 'DELETE FROM Books WHERE id_book = $1'
     await connection.execute(delete_query, id_book)
+    await autocomplete_index.publish(connection, 'books', id_book)
+    await report_cache.invalidate(connection)
     
     return {"status": "success"}
 
@@ -225,6 +311,11 @@ async def create_book(
             '''
             await connection.execute(create_book_genre_query, new_book_id, genre_id)
 
+        await connection.execute('SELECT refresh_book_search($1::uuid[])', [new_book_id])
+
+    await autocomplete_index.publish(connection, 'books', new_book_id, book.title)
+    await report_cache.invalidate(connection)
+
     return {
         'status': 'success',
         'id_book': new_book_id
@@ -272,6 +363,11 @@ async def update_book(
             VALUES ($1, $2)
             '''
             await connection.execute(create_book_genre_query, id_book, genre_id)
+
+        await connection.execute('SELECT refresh_book_search($1::uuid[])', [id_book])
+
+    await autocomplete_index.publish(connection, 'books', id_book, updated_book.title)
+    await report_cache.invalidate(connection)
     
     return {
         "status": "success",
@@ -288,9 +384,12 @@ async def get_borrows(
     limit: int = Query(10, gt=0, ge=0),
     sort_by: str =  Query("", regex="^(|borrow_date|return_date$)"),
     desc: bool = Query(default=True),
+    expand: bool = Query(default=False, description="Inline book and user objects"),
+    include_archived: bool = Query(default=False, description="Also read archived borrows"),
     connection: Connection = Depends(get_db_connection)
 ):
-    query = '''SELECT id_borrow, id_user, id_book, is_returned, borrow_date, return_date FROM BorrowReturnLogs'''
+    source = borrows_source(include_archived)
+    query = f'''SELECT id_borrow, id_user, id_book, is_returned, borrow_date, return_date FROM {source}'''
     query_params = {}
     
     if id_user is not None:
@@ -312,11 +411,18 @@ async def get_borrows(
     borrows = await connection.fetch(query, *query_params.values())
     
 
-    total_count_query = '''SELECT COUNT(*) FROM BorrowReturnLogs'''
+    total_count_query = f'''SELECT COUNT(*) FROM {source}'''
     if where_conditions:
         total_count_query += f" WHERE {where_conditions}"
     total_count = await connection.fetchval(total_count_query, *query_params.values())
 
+    if expand:
+        books = await fetch_books(connection, [borrow['id_book'] for borrow in borrows])
+        users = await fetch_users(connection, [borrow['id_user'] for borrow in borrows])
+        borrows = [
+            {**borrow, 'book': books.get(borrow['id_book']), 'user': users.get(borrow['id_user'])}
+            for borrow in borrows
+        ]
     
     return {
         'borrows': borrows,
@@ -327,6 +433,19 @@ async def get_borrows(
     }
     
 
+@book_router.post('/borrows/batch', dependencies=[Depends(api_key_read)])
+async def get_borrows_batch(
+    batch: BatchIds,
+    connection: Connection = Depends(get_db_connection)
+):
+    borrows, not_found = in_request_order(batch.ids, await fetch_borrows(connection, batch.ids))
+    
+    return {
+        'borrows': borrows,
+        'not_found': not_found
+    }
+
+
 @book_router.get('/borrows/id', dependencies=[Depends(api_key_auth)])
 async def get_borrow(
     id_borrow: uuid.UUID,
@@ -346,10 +465,11 @@ async def get_borrow(
 @book_router.delete('/borrows/id', dependencies=[Depends(api_key_auth)])
 async def delete_borrow(
     id_borrow: uuid.UUID,
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(get_db_priority_connection)
 ):
     query = '''DELETE FROM BorrowReturnLogs WHERE id_borrow = $1'''
     await connection.execute(query, id_borrow)
+    await report_cache.invalidate(connection)
     
     return {
         'status': 'success',
@@ -360,19 +480,33 @@ async def delete_borrow(
 async def add_borrows(
     id_user: uuid.UUID,
     books_borrows: BookBorrow,
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(get_db_priority_connection)
 ):
+    # sorted ids keep the lock order stable between concurrent checkouts
+    books_ids = sorted(set(books_borrows.books_ids))
     async with connection.transaction():
-        for ids_books in books_borrows.books_ids:
-            query = '''
-                INSERT INTO BorrowReturnLogs (id_user, id_book, borrow_date, return_date) 
-                VALUES ($1, $2, $3, $4)
-                ON CONFLICT DO NOTHING
-                '''
-            await connection.execute(query, id_user, ids_books, books_borrows.borrow_date, books_borrows.return_date)
+        # the open-borrow unique index makes the insert claim the book atomically
+        query = '''
+            INSERT INTO BorrowReturnLogs (id_user, id_book, borrow_date, return_date) 
+            SELECT $1, id_book, $3, $4 FROM unnest($2::uuid[]) AS id_book
+            ON CONFLICT (id_book) WHERE is_returned = FALSE DO NOTHING
+            RETURNING id_borrow, id_book
+            '''
+        borrows = await connection.fetch(query, id_user, books_ids, books_borrows.borrow_date, books_borrows.return_date)
+
+        borrowed_ids = {borrow['id_book'] for borrow in borrows}
+        unavailable = [id_book for id_book in books_ids if id_book not in borrowed_ids]
+        if unavailable:
+            raise HTTPException(
+                status_code=409,
+                detail={'message': 'Books are already borrowed', 'unavailable': unavailable}
+            )
+
+        await report_cache.invalidate(connection)
 
     return {
         'status': 'success',
+        'borrows': borrows,
     }
 
 
@@ -380,10 +514,14 @@ async def add_borrows(
 async def change_borrow_status(
     id_borrow: uuid.UUID,
     status: bool = Query(default=True),
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(get_db_priority_connection)
 ):
     query = "UPDATE BorrowReturnLogs SET is_returned = $1 WHERE id_borrow = $2"
-    await connection.execute(query, status, id_borrow)
+    try:
+        await connection.execute(query, status, id_borrow)
+    except UniqueViolationError:
+        raise HTTPException(status_code=409, detail='Book is already borrowed')
+    await report_cache.invalidate(connection)
 
     return {
         'status': 'success',
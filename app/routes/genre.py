@@ -3,8 +3,9 @@ from asyncpg import Connection
 import uuid
 
 from depends import api_key_auth
-from database import get_db_connection
+from database import get_db_connection, get_db_read_connection
 from schemas import GenreUpdate, GenreCreate
+from utils import autocomplete_index, report_cache, coalesce
 
 
 genre_router = APIRouter(
@@ -20,6 +21,7 @@ async def create_genre(
 ):
     query = "INSERT INTO Genres (genre_name) VALUES ($1) RETURNING id_genre"
     new_genre_id = await connection.fetchval(query, genre.genre_name)
+    await autocomplete_index.publish(connection, 'genres', new_genre_id, genre.genre_name)
     
     return {
         "status": "success", 
@@ -28,11 +30,12 @@ async def create_genre(
 
 
 @genre_router.get('', dependencies=[Depends(api_key_auth)])
+@coalesce('genres')
 async def get_genres(
     offset: int = Query(0, ge=0),
     limit: int = Query(10, gt=0),
     desc: bool = Query(False, description="Sort in descending order"),
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(get_db_read_connection)
 ):
     order_by = ' DESC' if desc else ' ASC'  
     query = f"SELECT id_genre, genre_name FROM Genres ORDER BY genre_name {order_by}"
@@ -53,9 +56,10 @@ async def get_genres(
 
 
 @genre_router.get('/id', dependencies=[Depends(api_key_auth)])
+@coalesce('genres/id')
 async def get_genre(
     id_genre: uuid.UUID,
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(get_db_read_connection)
 ):
     query = "SELECT id_genre, genre_name FROM Genres WHERE id_genre = $1 LIMIT 1"
     genre = await connection.fetchrow(query, id_genre)
@@ -70,8 +74,15 @@ async def delete_genre(
     id_genre: uuid.UUID,
     connection: Connection = Depends(get_db_connection)
 ):
-    delete_query = 'DELETE FROM Genres WHERE id_genre = $1'
-    await connection.execute(delete_query, id_genre)
+    async with connection.transaction():
+        book_ids = await connection.fetchval(
+            'SELECT ARRAY(SELECT id_book FROM BookGenres WHERE id_genre = $1)', id_genre
+        )
+        delete_query = 'DELETE FROM Genres WHERE id_genre = $1'
+        await connection.execute(delete_query, id_genre)
+        await connection.execute('SELECT refresh_book_search($1::uuid[])', book_ids)
+    await autocomplete_index.publish(connection, 'genres', id_genre)
+    await report_cache.invalidate(connection)
     
     return {"status": "success"}
 
@@ -82,8 +93,14 @@ async def update_genre(
     genre: GenreUpdate,
     connection: Connection = Depends(get_db_connection)
 ):
-    query = "UPDATE Genres SET genre_name = $1 WHERE id_genre = $2"
-    await connection.execute(query, genre.genre_name, id_genre)
+    async with connection.transaction():
+        query = "UPDATE Genres SET genre_name = $1 WHERE id_genre = $2"
+        await connection.execute(query, genre.genre_name, id_genre)
+        await connection.execute(
+            'SELECT refresh_book_search(ARRAY(SELECT id_book FROM BookGenres WHERE id_genre = $1))', id_genre
+        )
+    await autocomplete_index.publish(connection, 'genres', id_genre, genre.genre_name)
+    await report_cache.invalidate(connection)
     
     return {
         'status': 'success',
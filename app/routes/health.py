@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Request, Response, status
+
+from utils import listener
+
+
+health_router = APIRouter(
+    prefix='/health',
+    tags=['Health']
+)
+
+
+@health_router.get('/live')
+async def live():
+    return {'status': 'ok'}
+
+
+@health_router.get('/ready')
+async def ready(request: Request, response: Response):
+    '''
+    ready once migrations ran and the pool is open, unready again while shutting down
+    and while the notification listener is reconnecting, the caches may be stale meanwhile
+    '''
+    if not getattr(request.app.state, 'ready', False) or not listener.connected:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {'status': 'unavailable'}
+    return {'status': 'ready'}
@@ -0,0 +1,74 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from asyncpg import Connection
+import uuid
+import json
+
+from depends import api_key_admin
+from database import get_db_connection
+from schemas import JobCreate
+from jobs.runner import CHANNEL, REPORTS
+
+
+jobs_router = APIRouter(
+    prefix='/jobs',
+    tags=['Jobs']
+)
+
+
+@jobs_router.post('', dependencies=[Depends(api_key_admin)])
+async def submit_job(
+    job: JobCreate,
+    connection: Connection = Depends(get_db_connection)
+):
+    if job.job_type == 'report' and job.params.get('name') not in REPORTS:
+        raise HTTPException(status_code=400, detail={'message': 'Unknown report', 'reports': list(REPORTS)})
+
+    async with connection.transaction():
+        id_job = await connection.fetchval(
+            'INSERT INTO Jobs (job_type, params) VALUES ($1, $2::jsonb) RETURNING id_job',
+            job.job_type, json.dumps(job.params)
+        )
+        # delivered on commit, wakes an idle runner in any worker
+        await connection.execute('SELECT pg_notify($1, $2)', CHANNEL, str(id_job))
+
+    return {
+        'id_job': id_job,
+        'status': 'queued'
+    }
+
+
+@jobs_router.get('/id', dependencies=[Depends(api_key_admin)])
+async def get_job(
+    id_job: uuid.UUID = Query(description='uuid'),
+    connection: Connection = Depends(get_db_connection)
+):
+    query = '''
+        SELECT id_job, job_type, params, status, progress, error, attempts,
+            created_at, started_at, finished_at
+        FROM Jobs WHERE id_job = $1
+    '''
+    job = await connection.fetchrow(query, id_job)
+    if job is None:
+        raise HTTPException(status_code=404, detail='Job not found')
+
+    return {
+        'job': {**job, 'params': json.loads(job['params'])}
+    }
+
+
+@jobs_router.get('/id/result', dependencies=[Depends(api_key_admin)])
+async def get_job_result(
+    id_job: uuid.UUID = Query(description='uuid'),
+    connection: Connection = Depends(get_db_connection)
+):
+    job = await connection.fetchrow('SELECT status, result, error FROM Jobs WHERE id_job = $1', id_job)
+    if job is None:
+        raise HTTPException(status_code=404, detail='Job not found')
+    if job['status'] == 'failed':
+        raise HTTPException(status_code=500, detail={'message': 'Job failed', 'error': job['error']})
+    if job['status'] != 'done':
+        raise HTTPException(status_code=409, detail={'message': 'Job is not finished', 'status': job['status']})
+
+    return {
+        'result': json.loads(job['result'])
+    }
@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from depends import api_key_admin
+from utils import metrics
+
+
+metrics_router = APIRouter(
+    prefix='/metrics',
+    tags=['Metrics']
+)
+
+
+@metrics_router.get('', dependencies=[Depends(api_key_admin)], response_class=PlainTextResponse)
+async def get_metrics():
+    return metrics.render()
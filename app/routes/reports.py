@@ -6,7 +6,8 @@ import json
 
 from settings import settings
 from depends import api_key_auth
-from database import get_db_connection
+from utils import report_cache
+from utils.borrows import borrows_source, book_is_out
 
 
 reports_router = APIRouter(
@@ -16,26 +17,14 @@ reports_router = APIRouter(
 
 
 @reports_router.get('/books/available', dependencies=[Depends(api_key_auth)])
+@report_cache.cached('reports/books/available')
 async def get_availableable_books(
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(report_cache.connection)
 ):
     query = f'''
-        SELECT BookDetails.id_book, COALESCE(last_borrow.is_returned, TRUE) as is_available
+        SELECT BookDetails.id_book, TRUE as is_available
         FROM BookDetails 
-        LEFT JOIN (
-            SELECT 
-                br.id_book, 
-                return_date, 
-                is_returned, 
-                id_user
-            FROM BorrowReturnLogs br
-            WHERE (br.id_book, br.return_date) IN (
-                SELECT id_book, MAX(return_date)
-                FROM BorrowReturnLogs
-                GROUP BY id_book
-            )
-        ) AS last_borrow ON BookDetails.id_book = last_borrow.id_book
-        WHERE COALESCE(last_borrow.is_returned, TRUE) = TRUE 
+        WHERE NOT {book_is_out('BookDetails.id_book')}
         ORDER BY title ASC
     '''
     books = await connection.fetch(query)    
@@ -47,11 +36,12 @@ async def get_availableable_books(
 
 
 @reports_router.get('/books/users/all',  dependencies=[Depends(api_key_auth)])
+@report_cache.cached('reports/books/users/all')
 async def get_users_total_borrowed_books(
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(report_cache.connection)
 ):
-    query = '''SELECT id_user, COUNT(id_book) AS total_count
-        FROM BorrowReturnLogs
+    query = f'''SELECT id_user, COUNT(id_book) AS total_count
+        FROM {borrows_source(include_archived=True)}
         GROUP BY id_user
     '''
     result = await connection.fetch(query)
@@ -64,8 +54,9 @@ async def get_users_total_borrowed_books(
 
 
 @reports_router.get('/books/users/current',  dependencies=[Depends(api_key_auth)])
+@report_cache.cached('reports/books/users/current')
 async def get_users_current_borrowed_books(
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(report_cache.connection)
 ):
     query = '''SELECT id_user, COUNT(id_book) AS count
         FROM BorrowReturnLogs
@@ -82,11 +73,12 @@ async def get_users_current_borrowed_books(
 
 
 @reports_router.get('/visit/last',  dependencies=[Depends(api_key_auth)])
+@report_cache.cached('reports/visit/last')
 async def get_users_last_visit(
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(report_cache.connection)
 ):
-    query = '''SELECT id_user, MAX(borrow_date) AS date
-        FROM BorrowReturnLogs
+    query = f'''SELECT id_user, MAX(borrow_date) AS date
+        FROM {borrows_source(include_archived=True)}
         GROUP BY id_user
     '''
     result = await connection.fetch(query)
@@ -99,15 +91,16 @@ async def get_users_last_visit(
 
 
 @reports_router.get('/genres/popular',  dependencies=[Depends(api_key_auth)])
+@report_cache.cached('reports/genres/popular')
 async def get_users_borrowed_books(
     limit: int = Query(default=None, gt=0),
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(report_cache.connection)
 ):
-    query = '''SELECT g.genre_name, COUNT(*) AS genre_count
+    query = f'''SELECT g.genre_name, COUNT(*) AS genre_count
         FROM Books b
         JOIN BookGenres bg ON b.id_book = bg.id_book
         JOIN Genres g ON bg.id_genre = g.id_genre
-        JOIN BorrowReturnLogs brl ON b.id_book = brl.id_book
+        JOIN {borrows_source(include_archived=True, alias='brl')} ON b.id_book = brl.id_book
         GROUP BY g.genre_name
         ORDER BY genre_count DESC
     '''
@@ -123,9 +116,10 @@ async def get_users_borrowed_books(
 
 
 @reports_router.get('/borrows/fine',  dependencies=[Depends(api_key_auth)])
+@report_cache.cached('reports/borrows/fine')
 async def get_fine_borrows(
     limit: int = Query(default=None, gt=0),
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(report_cache.connection)
 ):
     query = '''SELECT u.full_name AS full_name, 
         b.title AS book_title, 
@@ -150,9 +144,10 @@ async def get_fine_borrows(
 
 
 @reports_router.get('/borrows/geo',  dependencies=[Depends(api_key_auth)])
+@report_cache.cached('reports/borrows/geo')
 async def get_borrowed_users_geo(
     limit: int = Query(default=None, gt=0),
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(report_cache.connection)
 ):
     query = '''
         SELECT br.id_book,
@@ -1,10 +1,16 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
 from asyncpg import Connection
+from datetime import date
+from typing import Optional
 import uuid
+import json
 
-from depends import api_key_auth
-from database import get_db_connection
-from schemas import UserCreate, UserSuccess, UserUpdate
+from depends import api_key_auth, api_key_read
+from database import get_db_connection, get_db_read_connection
+from schemas import UserCreate, UserSuccess, UserUpdate, BatchIds
+from utils import autocomplete_index, report_cache
+from utils.batch import fetch_users, in_request_order
+from utils.borrows import borrows_source
 
 
 user_router = APIRouter(
@@ -19,7 +25,7 @@ async def get_users(
     limit: int = Query(10, gt=0),
     sort_by: str = Query('', regex="^(|full_name|address)$"),
     desc: bool = Query(False, description="Sorting"),
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(get_db_read_connection)
 ):
     order = " DESC " if desc else " ASC "
     query = f'''SELECT id_user, full_name, birth_date, address, phone_number FROM Users '''
@@ -43,7 +49,7 @@ async def get_users(
 @user_router.get('/id', dependencies=[Depends(api_key_auth)])
 async def get_user(
     id_user: uuid.UUID = Query(description='uuid'),
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(get_db_read_connection)
 ):
     query = '''SELECT id_user, full_name, birth_date, address, phone_number FROM Users WHERE id_user = $1 LIMIT 1'''
     user = await connection.fetchrow(query, id_user)
@@ -53,6 +59,98 @@ async def get_user(
     }
 
 
+@user_router.get('/id/history', dependencies=[Depends(api_key_auth)])
+async def get_user_history(
+    id_user: uuid.UUID,
+    after_date: Optional[date] = Query(None, description="borrow_date of the last item on the previous page"),
+    after_id: Optional[uuid.UUID] = Query(None, description="id_borrow of the last item on the previous page"),
+    limit: int = Query(10, gt=0),
+    include_archived: bool = Query(False, description="Also read archived borrows"),
+    connection: Connection = Depends(get_db_connection)
+):
+    if (after_date is None) != (after_id is None):
+        raise HTTPException(status_code=422, detail='after_date and after_id must be given together')
+
+    source = borrows_source(include_archived, 'br')
+    # last_visit reads the archive too, archiving must not forget when a user came
+    profile_query = f'''
+        SELECT u.id_user, u.full_name, u.birth_date, u.address, u.phone_number,
+            (SELECT COUNT(*) FROM BorrowReturnLogs br
+                WHERE br.id_user = u.id_user AND br.is_returned = FALSE) AS open_count,
+            (SELECT MAX(br.borrow_date) FROM {borrows_source(True, 'br')}
+                WHERE br.id_user = u.id_user) AS last_visit
+        FROM Users u
+        WHERE u.id_user = $1
+    '''
+    user = await connection.fetchrow(profile_query, id_user)
+    if user is None:
+        return {'user': None}
+
+    overdue_query = '''
+        SELECT br.id_borrow, br.id_book, b.title, br.borrow_date, br.return_date
+        FROM BorrowReturnLogs br
+        JOIN Books b ON br.id_book = b.id_book
+        WHERE br.id_user = $1 AND br.is_returned = FALSE AND br.return_date < CURRENT_DATE
+        ORDER BY br.return_date
+    '''
+    overdue = await connection.fetch(overdue_query, id_user)
+
+    # keyset pagination: the page starts right after the (borrow_date, id_borrow) cursor
+    query_params = [id_user, limit]
+    cursor_condition = ''
+    if after_date is not None and after_id is not None:
+        cursor_condition = 'AND (br.borrow_date, br.id_borrow) < ($3, $4)'
+        query_params += [after_date, after_id]
+
+    history_query = f'''
+        SELECT br.id_borrow, br.id_book, b.title, authors.authors,
+            br.is_returned, br.borrow_date, br.return_date
+        FROM {source}
+        JOIN Books b ON br.id_book = b.id_book
+        LEFT JOIN LATERAL (
+            SELECT jsonb_agg(jsonb_build_object(
+                'id_author', a.id_author,
+                'author_name', a.author_name
+            )) AS authors
+            FROM BookAuthors ba
+            JOIN Authors a ON ba.id_author = a.id_author
+            WHERE ba.id_book = br.id_book
+        ) AS authors ON TRUE
+        WHERE br.id_user = $1 {cursor_condition}
+        ORDER BY br.borrow_date DESC, br.id_borrow DESC
+        LIMIT $2
+    '''
+    history = []
+    for borrow in await connection.fetch(history_query, *query_params):
+        borrow_dict = dict(borrow)
+        borrow_dict['authors'] = json.loads(borrow_dict['authors']) if borrow_dict['authors'] else []
+        history.append(borrow_dict)
+
+    next_cursor = None
+    if len(history) == limit:
+        next_cursor = {'after_date': history[-1]['borrow_date'], 'after_id': history[-1]['id_borrow']}
+
+    return {
+        'user': user,
+        'overdue': overdue,
+        'history': history,
+        'next_cursor': next_cursor
+    }
+
+
+@user_router.post('/batch', dependencies=[Depends(api_key_read)])
+async def get_users_batch(
+    batch: BatchIds,
+    connection: Connection = Depends(get_db_read_connection)
+):
+    users, not_found = in_request_order(batch.ids, await fetch_users(connection, batch.ids))
+
+    return {
+        'users': users,
+        'not_found': not_found
+    }
+
+
 @user_router.delete('/id', dependencies=[Depends(api_key_auth)])
 async def delete_user(
     id_user: uuid.UUID = Query(),
@@ -60,6 +158,8 @@ async def delete_user(
 ):
     query = '''DELETE FROM Users WHERE id_user = $1'''
     await connection.execute(query, id_user)
+    await autocomplete_index.publish(connection, 'users', id_user)
+    await report_cache.invalidate(connection)
 
     return {
         "status": "success"
@@ -69,7 +169,7 @@ async def delete_user(
 @user_router.get('/phone', dependencies=[Depends(api_key_auth)])
 async def get_user_by_phone(
     phone_number: str = Query(regex='^7[0-9]{10}$'),
-    connection: Connection = Depends(get_db_connection)
+    connection: Connection = Depends(get_db_read_connection)
 ):
     query = '''SELECT id_user, full_name, birth_date, address FROM Users WHERE phone_number = $1 LIMIT 1'''
     user = await connection.fetchrow(query, phone_number)
@@ -91,6 +191,8 @@ async def create_user(
     """
     
     new_id_user = await connection.fetchval(query, user.full_name, user.birth_date, user.address, user.phone_number)
+    await autocomplete_index.publish(connection, 'users', new_id_user, user.full_name)
+    await report_cache.invalidate(connection)
     
     return UserSuccess(
         id_user=new_id_user,
@@ -107,6 +209,8 @@ async def update_user(
     query = """UPDATE Users SET full_name = $2, birth_date = $3, address = $4 WHERE id_user = $1"""
     
     await connection.execute(query, id_user, user.full_name, user.birth_date, user.address)
+    await autocomplete_index.publish(connection, 'users', id_user, user.full_name)
+    await report_cache.invalidate(connection)
     return UserSuccess(
         id_user=id_user,
         status='success'
@@ -2,4 +2,8 @@ from .login import SuccessLogin
 from .users import UserCreate, UserSuccess, UserUpdate
 from .books import BookCreate, BookUpdate, BookBorrow
 from .authors import AuthorCreate, AuthorEdit
-from .genres import GenreCreate, GenreUpdate
\ No newline at end of file
+from .genres import GenreCreate, GenreUpdate
+from .batch import (BatchIds, BatchOperations, UserByPhoneParams,
+                    BookStatusParams, AddBorrowsParams, BorrowStatusParams)
+from .jobs import JobCreate
+from .api_keys import ApiKeyCreate
\ No newline at end of file
@@ -0,0 +1,8 @@
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+
+
+class ApiKeyCreate(BaseModel):
+    client: str = Field(min_length=1, max_length=100)
+    scopes: List[Literal['read', 'write', 'admin', '*']] = Field(min_length=1)
+    expires_in_days: Optional[int] = Field(None, gt=0)
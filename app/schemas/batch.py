@@ -0,0 +1,44 @@
+from pydantic import BaseModel, Field, constr
+from typing import Any, Dict, List, Literal
+from uuid import UUID
+
+from settings import settings
+from .books import BookBorrow
+
+
+class BatchIds(BaseModel):
+    ids: List[UUID] = Field(min_length=1, max_length=settings.batch_max_ids)
+
+
+class BatchOperation(BaseModel):
+    op: Literal[
+        'get_user_by_phone',
+        'get_book_status',
+        'get_books',
+        'get_borrows',
+        'add_borrows',
+        'change_borrow_status',
+    ]
+    # string values like "$0.user.id_user" refer to the results of previous operations
+    params: Dict[str, Any] = {}
+
+
+class BatchOperations(BaseModel):
+    operations: List[BatchOperation] = Field(min_length=1, max_length=settings.batch_max_operations)
+
+
+class UserByPhoneParams(BaseModel):
+    phone_number: constr(pattern=r'^7[0-9]{10}$')
+
+
+class BookStatusParams(BaseModel):
+    id_book: UUID
+
+
+class AddBorrowsParams(BookBorrow):
+    id_user: UUID
+
+
+class BorrowStatusParams(BaseModel):
+    id_borrow: UUID
+    status: bool = True
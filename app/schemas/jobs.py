@@ -0,0 +1,7 @@
+from pydantic import BaseModel
+from typing import Any, Dict, Literal
+
+
+class JobCreate(BaseModel):
+    job_type: Literal['recommendations', 'archive', 'search_reindex', 'report']
+    params: Dict[str, Any] = {}
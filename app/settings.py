@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings
+from typing import List
 import dotenv
 import os
 
@@ -15,6 +16,74 @@ class Settings(BaseSettings):
     api_key: str = os.getenv('API_KEY')
     api_user: str = os.getenv('API_USER')
     api_password: str = os.getenv('API_PASSWORD')
+    # verified keys are trusted this long without a query, revocations also arrive by NOTIFY
+    api_key_cache_ttl: float = float(os.getenv('API_KEY_CACHE_TTL', 60))
+    api_key_negative_ttl: float = float(os.getenv('API_KEY_NEGATIVE_TTL', 5))
+    # database lookups of keys not in the cache, per worker, beyond it requests get 503
+    api_key_lookups_per_second: float = float(os.getenv('API_KEY_LOOKUPS_PER_SECOND', 100))
+    # lifetime of the key issued by /login
+    login_key_ttl_hours: int = int(os.getenv('LOGIN_KEY_TTL_HOURS', 24))
+
+    workers: int = int(os.getenv('WORKERS', 1))
+    # the whole shutdown, requests and jobs, keep it below the container stop grace period
+    graceful_shutdown_timeout: int = int(os.getenv('GRACEFUL_SHUTDOWN_TIMEOUT', 30))
+    # migrations run once in the master process when serving with several workers
+    run_migrations: bool = os.getenv('RUN_MIGRATIONS', 'true').lower() == 'true'
+
+    # max postgres connections for all workers together, split evenly between them
+    db_connection_budget: int = int(os.getenv('DB_CONNECTION_BUDGET', 90))
+    db_pool_min_size: int = int(os.getenv('DB_POOL_MIN_SIZE', 2))
+
+    # statement timeouts in ms per route class, see database.engine.ROUTE_CLASSES
+    db_statement_timeout: int = int(os.getenv('DB_STATEMENT_TIMEOUT', 5000))
+    db_priority_statement_timeout: int = int(os.getenv('DB_PRIORITY_STATEMENT_TIMEOUT', 2000))
+    db_report_statement_timeout: int = int(os.getenv('DB_REPORT_STATEMENT_TIMEOUT', 30000))
+    # requests waiting for a pool beyond this count or this many seconds get 503
+    db_admission_queue: int = int(os.getenv('DB_ADMISSION_QUEUE', 100))
+    db_admission_timeout: float = float(os.getenv('DB_ADMISSION_TIMEOUT', 5))
+    retry_after_seconds: int = int(os.getenv('RETRY_AFTER_SECONDS', 1))
+
+    # comma separated replica DSNs, reads fall back to the primary when empty or lagging
+    db_replica_urls: List[str] = [url.strip() for url in os.getenv('POSTGRES_REPLICA_URLS', '').split(',') if url.strip()]
+    db_replica_connection_budget: int = int(os.getenv('DB_REPLICA_CONNECTION_BUDGET', db_connection_budget))
+    replica_max_lag_seconds: float = float(os.getenv('REPLICA_MAX_LAG_SECONDS', 5))
+    replica_lag_check_interval: float = float(os.getenv('REPLICA_LAG_CHECK_INTERVAL', 2))
+
+    # seconds the notification listener may go without a sign of life before it reconnects
+    listener_check_interval: float = float(os.getenv('LISTENER_CHECK_INTERVAL', 5))
+
+    # memory (per worker) or postgres (shared by all workers)
+    response_cache_backend: str = os.getenv('RESPONSE_CACHE_BACKEND', 'memory')
+    response_cache_ttl: float = float(os.getenv('RESPONSE_CACHE_TTL', 30))
+
+    # books a search considers per kind of match (words, title, author), it ranks and counts only those
+    search_max_candidates: int = int(os.getenv('SEARCH_MAX_CANDIDATES', 1000))
+
+    recommendations_top_k: int = int(os.getenv('RECOMMENDATIONS_TOP_K', 20))
+
+    # returned borrows older than this move to BorrowReturnLogsArchive
+    archive_after_days: int = int(os.getenv('ARCHIVE_AFTER_DAYS', 365))
+    archive_batch_size: int = int(os.getenv('ARCHIVE_BATCH_SIZE', 5000))
+    # the runners queue an archive job this often, 0 leaves it to POST /jobs
+    archive_interval_hours: float = float(os.getenv('ARCHIVE_INTERVAL_HOURS', 24))
+
+    # jobs a worker runs at once, each holds one pool connection
+    jobs_max_running: int = int(os.getenv('JOBS_MAX_RUNNING', 2))
+    jobs_poll_interval: float = float(os.getenv('JOBS_POLL_INTERVAL', 5))
+    # a running job without a heartbeat for this long is picked up again
+    jobs_lease_seconds: int = int(os.getenv('JOBS_LEASE_SECONDS', 60))
+    # a job that keeps losing its lease (a crashing worker) fails instead of being retried forever
+    jobs_max_attempts: int = int(os.getenv('JOBS_MAX_ATTEMPTS', 3))
+    # part of graceful_shutdown_timeout running jobs get to finish, requests get the rest
+    jobs_shutdown_timeout: int = int(os.getenv('JOBS_SHUTDOWN_TIMEOUT', 10))
+
+    # smaller responses are sent uncompressed, compressing them costs more than it saves
+    compression_min_size: int = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+    gzip_level: int = int(os.getenv('GZIP_LEVEL', 6))
+    brotli_quality: int = int(os.getenv('BROTLI_QUALITY', 4))
+
+    batch_max_ids: int = int(os.getenv('BATCH_MAX_IDS', 100))
+    batch_max_operations: int = int(os.getenv('BATCH_MAX_OPERATIONS', 50))
 
 
 settings = Settings()
\ No newline at end of file
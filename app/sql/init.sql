@@ -1,3 +1,6 @@
+-- Расширение для нечеткого поиска по триграммам
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Создание таблицы пользователей
 CREATE TABLE IF NOT EXISTS Users (
     id_user UUID PRIMARY KEY DEFAULT (gen_random_uuid()),
@@ -16,6 +19,7 @@ CREATE TABLE IF NOT EXISTS Authors (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+CREATE INDEX IF NOT EXISTS idx_author_name_trgm ON Authors USING GIN (author_name gin_trgm_ops);
 
 -- Создание таблицы жанров
 CREATE TABLE IF NOT EXISTS Genres (
@@ -34,6 +38,11 @@ CREATE TABLE IF NOT EXISTS Books (
 );
 CREATE INDEX IF NOT EXISTS idx_book_name ON Books(title);
 
+-- Поисковый документ книги: название, авторы и жанры
+ALTER TABLE Books ADD COLUMN IF NOT EXISTS search_vector TSVECTOR NOT NULL DEFAULT ''::tsvector;
+CREATE INDEX IF NOT EXISTS idx_book_search ON Books USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_book_title_trgm ON Books USING GIN (title gin_trgm_ops);
+
 -- Создание таблицы связи книг и авторов
 CREATE TABLE IF NOT EXISTS BookAuthors (
     id_book UUID NOT NULL,
@@ -54,6 +63,33 @@ CREATE TABLE IF NOT EXISTS BookGenres (
     CONSTRAINT unique_book_genre_combination UNIQUE (id_book, id_genre)
 );
 
+-- Индексы для поиска книг по автору и жанру
+CREATE INDEX IF NOT EXISTS idx_book_authors_author ON BookAuthors(id_author);
+CREATE INDEX IF NOT EXISTS idx_book_genres_genre ON BookGenres(id_genre);
+
+-- Пересчет поискового документа для указанных книг
+CREATE OR REPLACE FUNCTION refresh_book_search(book_ids UUID[])
+RETURNS VOID AS $$
+BEGIN
+    UPDATE Books b
+    SET search_vector =
+        setweight(to_tsvector('simple', b.title), 'A') ||
+        setweight(to_tsvector('simple', COALESCE((
+            SELECT string_agg(a.author_name, ' ')
+            FROM BookAuthors ba
+            JOIN Authors a ON ba.id_author = a.id_author
+            WHERE ba.id_book = b.id_book
+        ), '')), 'B') ||
+        setweight(to_tsvector('simple', COALESCE((
+            SELECT string_agg(g.genre_name, ' ')
+            FROM BookGenres bg
+            JOIN Genres g ON bg.id_genre = g.id_genre
+            WHERE bg.id_book = b.id_book
+        ), '')), 'C')
+    WHERE b.id_book = ANY(book_ids);
+END;
+$$ language 'plpgsql';
+
 -- Виртуальная таблица для объединения информации о книгах
 CREATE OR REPLACE VIEW BookDetails AS
 WITH UniqueAuthors AS (
@@ -115,6 +151,114 @@ CREATE TABLE IF NOT EXISTS BorrowReturnLogs (
     FOREIGN KEY (id_user) REFERENCES Users(id_user) ON DELETE CASCADE
 );
 
+-- Книга может быть выдана только один раз до возврата.
+-- В уже заполненной базе могут быть повторные открытые выдачи одной книги:
+-- до создания индекса они закрываются, остается самая ранняя
+DO $$
+BEGIN
+    IF to_regclass('idx_borrow_open_book') IS NULL THEN
+        UPDATE BorrowReturnLogs br
+        SET is_returned = TRUE, updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT id_borrow, ROW_NUMBER() OVER (
+                PARTITION BY id_book ORDER BY borrow_date, created_at, id_borrow
+            ) AS n
+            FROM BorrowReturnLogs
+            WHERE is_returned = FALSE
+        ) AS duplicates
+        WHERE br.id_borrow = duplicates.id_borrow AND duplicates.n > 1;
+    END IF;
+END $$;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_borrow_open_book ON BorrowReturnLogs(id_book) WHERE is_returned = FALSE;
+
+-- История и текущие выдачи пользователя
+CREATE INDEX IF NOT EXISTS idx_borrow_user_date ON BorrowReturnLogs(id_user, borrow_date DESC, id_borrow DESC);
+CREATE INDEX IF NOT EXISTS idx_borrow_user_open ON BorrowReturnLogs(id_user, return_date) WHERE is_returned = FALSE;
+CREATE INDEX IF NOT EXISTS idx_borrow_returned_date ON BorrowReturnLogs(return_date) WHERE is_returned = TRUE;
+
+-- Архив давно закрытых выдач, переносится фоновой задачей из BorrowReturnLogs
+CREATE TABLE IF NOT EXISTS BorrowReturnLogsArchive (
+    id_borrow UUID PRIMARY KEY,
+    id_book UUID NOT NULL,
+    id_user UUID NOT NULL,
+    borrow_date DATE NOT NULL,
+    return_date DATE NOT NULL,
+    created_at TIMESTAMP,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (id_book) REFERENCES Books(id_book) ON DELETE CASCADE,
+    FOREIGN KEY (id_user) REFERENCES Users(id_user) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_borrow_archive_user_date ON BorrowReturnLogsArchive(id_user, borrow_date DESC, id_borrow DESC);
+CREATE INDEX IF NOT EXISTS idx_borrow_archive_book ON BorrowReturnLogsArchive(id_book);
+
+-- Похожие книги: соседи по совместным выдачам, считаются фоновой задачей
+CREATE TABLE IF NOT EXISTS BookSimilarities (
+    id_book UUID NOT NULL,
+    id_similar UUID NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (id_book, id_similar),
+    FOREIGN KEY (id_book) REFERENCES Books(id_book) ON DELETE CASCADE,
+    FOREIGN KEY (id_similar) REFERENCES Books(id_book) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_book_similar_score ON BookSimilarities(id_book, score DESC);
+
+-- Момент, до которого выдачи уже учтены в BookSimilarities
+CREATE TABLE IF NOT EXISTS RecommendationState (
+    id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    processed_until TIMESTAMP NOT NULL
+);
+
+-- Очередь фоновых задач
+CREATE TABLE IF NOT EXISTS Jobs (
+    id_job UUID PRIMARY KEY DEFAULT (gen_random_uuid()),
+    job_type VARCHAR(50) NOT NULL,
+    params JSONB NOT NULL DEFAULT '{}',
+    status VARCHAR(20) NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'done', 'failed')),
+    progress REAL NOT NULL DEFAULT 0,
+    result JSONB,
+    error TEXT,
+    attempts INT NOT NULL DEFAULT 0,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_pending ON Jobs(created_at) WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS idx_jobs_type_created ON Jobs(job_type, created_at);
+
+-- API ключи клиентов, хранится только SHA-256 ключа
+CREATE TABLE IF NOT EXISTS ApiKeys (
+    id_key UUID PRIMARY KEY DEFAULT (gen_random_uuid()),
+    client VARCHAR(100) NOT NULL,
+    key_hash BYTEA NOT NULL UNIQUE,
+    scopes TEXT[] NOT NULL DEFAULT '{}',
+    expires_at TIMESTAMP,
+    revoked_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+-- Истекшие ключи удаляются при выдаче новых через /login
+CREATE INDEX IF NOT EXISTS idx_api_keys_expires ON ApiKeys(expires_at) WHERE expires_at IS NOT NULL;
+
+-- Учетные записи для /login, пароль хранится как scrypt-хэш
+CREATE TABLE IF NOT EXISTS ApiUsers (
+    login VARCHAR(100) PRIMARY KEY,
+    password_hash TEXT NOT NULL,
+    scopes TEXT[] NOT NULL DEFAULT '{}',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Общий кэш ответов отчетов, не пишется в WAL
+CREATE UNLOGGED TABLE IF NOT EXISTS ResponseCache (
+    cache_key TEXT PRIMARY KEY,
+    value JSONB NOT NULL,
+    expires_at TIMESTAMP NOT NULL
+);
+
+-- Поколение кэша отчетов, каждая инвалидация берет следующее значение
+CREATE SEQUENCE IF NOT EXISTS ResponseCacheGeneration;
+-- раньше поколение хранилось строкой кэша без срока
+DELETE FROM ResponseCache WHERE cache_key = 'reports_cache';
+
 -- Функция для обновления временной метки
 CREATE OR REPLACE FUNCTION update_updated_at_column()
 RETURNS TRIGGER AS $$
@@ -147,4 +291,9 @@ CREATE OR REPLACE TRIGGER update_books_updated_at BEFORE UPDATE
 -- BorrowReturnLogs
 CREATE OR REPLACE TRIGGER update_borrowlogs_updated_at BEFORE UPDATE
     ON BorrowReturnLogs FOR EACH ROW EXECUTE FUNCTION 
+    update_updated_at_column();
+
+-- Jobs
+CREATE OR REPLACE TRIGGER update_jobs_updated_at BEFORE UPDATE
+    ON Jobs FOR EACH ROW EXECUTE FUNCTION 
     update_updated_at_column();
\ No newline at end of file
@@ -1,6 +1,7 @@
 -- Очищаем таблицы
 TRUNCATE TABLE BookGenres CASCADE;
 TRUNCATE TABLE BorrowReturnLogs CASCADE;
+TRUNCATE TABLE BorrowReturnLogsArchive CASCADE;
 TRUNCATE TABLE Books CASCADE;
 TRUNCATE TABLE Genres CASCADE;
 TRUNCATE TABLE Authors CASCADE;
@@ -105,6 +106,11 @@ BEGIN
             (RANDOM() > 0.5),
             (CURRENT_DATE - (RANDOM() * 30)::int),  -- Случайная дата займа в пределах 30 дней назад
             (CURRENT_DATE - (RANDOM() * 30)::int) + (1 + (RANDOM() * 10)::int)  -- Случайная дата возврата от 1 до 10 дней позже
-        );
+        )
+        ON CONFLICT DO NOTHING;  -- Пропускаем повторную выдачу невозвращенной книги
     END LOOP;
 END $$;
+
+
+-- Построение поисковых документов книг
+SELECT refresh_book_search(ARRAY(SELECT id_book FROM Books));
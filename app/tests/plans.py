@@ -0,0 +1,96 @@
+'''
+Helpers to capture the statements an endpoint runs and to read their plans.
+'''
+from asyncpg import Connection
+from typing import Iterator, List, Set, Tuple
+import inspect
+import json
+
+
+class RecordingConnection:
+    ''' passes every call to the connection and keeps the statements with their arguments '''
+
+    def __init__(self, connection: Connection):
+        self._connection = connection
+        self.statements: List[Tuple[str, tuple]] = []
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    async def fetch(self, query: str, *args, **kwargs):
+        self.statements.append((query, args))
+        return await self._connection.fetch(query, *args, **kwargs)
+
+    async def fetchrow(self, query: str, *args, **kwargs):
+        self.statements.append((query, args))
+        return await self._connection.fetchrow(query, *args, **kwargs)
+
+    async def fetchval(self, query: str, *args, **kwargs):
+        self.statements.append((query, args))
+        return await self._connection.fetchval(query, *args, **kwargs)
+
+    async def execute(self, query: str, *args, **kwargs):
+        self.statements.append((query, args))
+        return await self._connection.execute(query, *args, **kwargs)
+
+
+async def record_statements(connection: Connection, handler, **params) -> List[Tuple[str, tuple]]:
+    '''
+    Runs the endpoint without its cache or coalescing decorators in a transaction
+    that is rolled back, returns the statements it ran.
+    '''
+    handler = getattr(handler, '__wrapped__', handler)
+    kwargs = {
+        name: params.get(name, getattr(parameter.default, 'default', parameter.default))
+        for name, parameter in inspect.signature(handler).parameters.items()
+        if name != 'connection'
+    }
+    recorder = RecordingConnection(connection)
+    transaction = connection.transaction()
+    await transaction.start()
+    try:
+        await handler(connection=recorder, **kwargs)
+    finally:
+        await transaction.rollback()
+    # notifications are not part of the data path
+    return [(query, args) for query, args in recorder.statements if 'pg_notify' not in query]
+
+
+async def explain(connection: Connection, query: str, args: tuple) -> dict:
+    ''' EXPLAIN ANALYZE runs the statement, so writes are rolled back afterwards '''
+    transaction = connection.transaction()
+    await transaction.start()
+    try:
+        plan = await connection.fetchval('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + query, *args)
+    finally:
+        await transaction.rollback()
+    return json.loads(plan)[0]['Plan']
+
+
+def nodes(plan: dict) -> Iterator[dict]:
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from nodes(child)
+
+
+def seq_scans(plan: dict) -> Iterator[Tuple[str, int]]:
+    ''' (table, rows read) of every sequential scan, over all loops '''
+    for node in nodes(plan):
+        if node['Node Type'] == 'Seq Scan':
+            rows = (node['Actual Rows'] + node.get('Rows Removed by Filter', 0)) * node['Actual Loops']
+            yield node['Relation Name'].lower(), rows
+
+
+def indexes(plan: dict) -> Set[str]:
+    ''' indexes scanned, plus the arbiter indexes of INSERT ... ON CONFLICT '''
+    used = set()
+    for node in nodes(plan):
+        if 'Index Name' in node:
+            used.add(node['Index Name'])
+        used.update(node.get('Conflict Arbiter Indexes', []))
+    return used
+
+
+def buffers(plan: dict) -> int:
+    # the counts of the top node include all its children
+    return plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0)
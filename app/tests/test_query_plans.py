@@ -0,0 +1,148 @@
+'''
+Plan regression tests for the hot endpoints.
+
+Every statement an endpoint runs is executed with EXPLAIN (ANALYZE, BUFFERS)
+on the generated dataset and must:
+  - not read more than SEQ_SCAN_ROWS rows of a large table with a sequential
+    scan, unless the endpoint reads that table as a whole by design
+  - use the indexes the endpoint was written for
+  - stay within its buffer budget, summed over all its statements
+'''
+from datetime import date, timedelta
+from typing import NamedTuple
+import os
+import pytest
+
+# the app settings need the same environment as the app itself
+if not os.getenv('PLAN_TEST_DSN'):
+    pytest.skip('PLAN_TEST_DSN is not set', allow_module_level=True)
+
+from routes import books, reports, users
+from schemas import BatchIds, BookBorrow
+from .plans import record_statements, explain, seq_scans, indexes, buffers
+
+
+LARGE_TABLES = {'books', 'borrowreturnlogs', 'borrowreturnlogsarchive'}
+SEQ_SCAN_ROWS = 1000
+
+# shared buffers per endpoint: one row, one page of rows
+POINT = 100
+PAGE = 1500
+# a pass over the generated data (conftest): Books with its authors and genres is about
+# 1.2k pages, the borrow log about 2.7k and its archive about 0.6k
+BOOK_DETAILS = 2500
+ALL_BORROWS_PAGES = 4000
+
+ALL_BORROWS = {'borrowreturnlogs', 'borrowreturnlogsarchive'}
+
+
+class Case(NamedTuple):
+    handler: object
+    params: object
+    budget: int
+    # tables the endpoint reads as a whole on purpose
+    full_scans: frozenset = frozenset()
+    expected_indexes: frozenset = frozenset()
+
+
+def borrow(data):
+    return BookBorrow(
+        books_ids=data['free_book_ids'],
+        borrow_date=date.today(),
+        return_date=date.today() + timedelta(days=14)
+    )
+
+
+CASES = {
+    'books/status/id': Case(books.get_book_status_by_id, lambda data: {'id_book': data['id_book']},
+                            POINT, expected_indexes=frozenset({'books_pkey', 'idx_borrow_open_book'})),
+    # a page in title order, the count comes from the open borrows and the Books primary key
+    'books/status': Case(books.get_books_by_status, lambda data: {},
+                         PAGE, expected_indexes=frozenset({'idx_book_name', 'idx_borrow_open_book'})),
+    # BookDetails aggregates authors and genres of every book before paging, then counts them,
+    # depending on the generated ids the planner picks one of two plans about 1k buffers apart
+    'books': Case(books.get_books, lambda data: {},
+                  BOOK_DETAILS + 1500, frozenset({'books'})),
+    'books?sort_by=title': Case(books.get_books, lambda data: {'sort_by': 'title'},
+                                BOOK_DETAILS + 1500, frozenset({'books'})),
+    # titles differ only in their number, "Book Title 12345" and the numbers it prefixes match
+    'books/search': Case(books.search_books, lambda data: {'q': '12345'},
+                         PAGE, expected_indexes=frozenset({'idx_book_search'})),
+    # no word matches as typed, the fuzzy title and author matches take over
+    'books/search?misspelled': Case(books.search_books, lambda data: {'q': 'Titel 12345'},
+                                    PAGE, expected_indexes=frozenset({'idx_book_title_trgm'})),
+    'books/id': Case(books.get_book, lambda data: {'id_book': data['id_book']},
+                     POINT, expected_indexes=frozenset({'books_pkey'})),
+    'books/id/similar': Case(books.get_similar_books, lambda data: {'id_book': data['id_book']},
+                             POINT, expected_indexes=frozenset({'idx_book_similar_score'})),
+    'books/batch': Case(books.get_books_batch, lambda data: {'batch': BatchIds(ids=data['book_ids'])},
+                        PAGE, expected_indexes=frozenset({'books_pkey'})),
+    'books/borrows?id_user': Case(books.get_borrows, lambda data: {'id_user': str(data['id_user'])},
+                                  PAGE, expected_indexes=frozenset({'idx_borrow_user_date'})),
+    'books/borrows?id_user&include_archived': Case(
+        books.get_borrows, lambda data: {'id_user': str(data['id_user']), 'include_archived': True},
+        PAGE, expected_indexes=frozenset({'idx_borrow_user_date', 'idx_borrow_archive_user_date'})
+    ),
+    'books/borrows/batch': Case(books.get_borrows_batch, lambda data: {'batch': BatchIds(ids=data['borrow_ids'])},
+                                PAGE, expected_indexes=frozenset({'borrowreturnlogs_pkey'})),
+    'books/borrows/id': Case(books.get_borrow, lambda data: {'id_borrow': data['id_borrow']},
+                             POINT, expected_indexes=frozenset({'borrowreturnlogs_pkey'})),
+    'POST books/borrows': Case(books.add_borrows,
+                               lambda data: {'id_user': data['id_user'], 'books_borrows': borrow(data)},
+                               POINT, expected_indexes=frozenset({'idx_borrow_open_book'})),
+    'PATCH books/borrows/id': Case(books.change_borrow_status, lambda data: {'id_borrow': data['id_borrow']},
+                                   POINT, expected_indexes=frozenset({'borrowreturnlogs_pkey'})),
+    'DELETE books/borrows/id': Case(books.delete_borrow, lambda data: {'id_borrow': data['id_borrow']},
+                                    POINT, expected_indexes=frozenset({'borrowreturnlogs_pkey'})),
+    'users/id/history': Case(users.get_user_history, lambda data: {'id_user': data['id_user']},
+                             PAGE, expected_indexes=frozenset({'idx_borrow_user_date'})),
+    'users/id/history?include_archived': Case(
+        users.get_user_history, lambda data: {'id_user': data['id_user'], 'include_archived': True},
+        PAGE, expected_indexes=frozenset({'idx_borrow_user_date', 'idx_borrow_archive_user_date'})
+    ),
+    # most books are available, listed with their details
+    'reports/books/available': Case(reports.get_availableable_books, lambda data: {},
+                                    BOOK_DETAILS, frozenset({'books'}),
+                                    frozenset({'idx_borrow_open_book'})),
+    # the whole borrow log is aggregated by design
+    'reports/books/users/all': Case(reports.get_users_total_borrowed_books, lambda data: {},
+                                    ALL_BORROWS_PAGES, frozenset(ALL_BORROWS)),
+    # only the open borrows, a few thousand rows
+    'reports/books/users/current': Case(reports.get_users_current_borrowed_books, lambda data: {},
+                                        PAGE),
+    'reports/visit/last': Case(reports.get_users_last_visit, lambda data: {},
+                               ALL_BORROWS_PAGES, frozenset(ALL_BORROWS)),
+    'reports/genres/popular': Case(reports.get_users_borrowed_books, lambda data: {},
+                                   ALL_BORROWS_PAGES + BOOK_DETAILS, frozenset({'books'} | ALL_BORROWS)),
+    # overdue open borrows, Books may be hashed whole for the titles
+    'reports/borrows/fine': Case(reports.get_fine_borrows, lambda data: {},
+                                 PAGE + 1000, frozenset({'books'})),
+    # the latest borrow of every book, the borrow log is read three times
+    'reports/borrows/geo': Case(reports.get_borrowed_users_geo, lambda data: {},
+                                3 * ALL_BORROWS_PAGES + 1000, frozenset({'borrowreturnlogs'})),
+}
+
+
+@pytest.mark.parametrize('name', CASES)
+def test_query_plan(name, loop, connection, dataset):
+    case = CASES[name]
+
+    async def plans():
+        statements = await record_statements(connection, case.handler, **case.params(dataset))
+        return [(query, await explain(connection, query, args)) for query, args in statements]
+
+    plans = loop.run_until_complete(plans())
+    assert plans, f'{name} ran no statements'
+
+    for query, plan in plans:
+        for table, rows in seq_scans(plan):
+            assert table not in LARGE_TABLES or table in case.full_scans or rows <= SEQ_SCAN_ROWS, (
+                f'{name}: sequential scan read {rows} rows of {table} in\n{query}'
+            )
+
+    used = set().union(*(indexes(plan) for _, plan in plans))
+    missing = case.expected_indexes - used
+    assert not missing, f'{name}: indexes {sorted(missing)} not used, plans used {sorted(used)}'
+
+    total = sum(buffers(plan) for _, plan in plans)
+    assert total <= case.budget, f'{name}: {total} buffers, budget {case.budget}'
@@ -0,0 +1,5 @@
+from .notify import listener
+from .autocomplete import autocomplete_index
+from .cache import report_cache
+from .metrics import metrics
+from .singleflight import coalesce
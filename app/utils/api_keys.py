@@ -0,0 +1,196 @@
+from asyncpg import Connection
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+import hashlib
+import secrets
+import time
+import uuid
+
+from database import acquire_connection, Overloaded
+from settings import settings
+from .passwords import hash_password, verify_password
+from .singleflight import SingleFlight
+
+
+CHANNEL = 'api_keys'
+KEY_PREFIX = 'lib_'
+
+
+class ApiKey(NamedTuple):
+    id_key: uuid.UUID
+    client: str
+    key_hash: bytes
+    scopes: FrozenSet[str]
+
+    def allows(self, scope: str) -> bool:
+        return '*' in self.scopes or scope in self.scopes
+
+
+def hash_key(api_key: str) -> bytes:
+    # keys are random 256 bit tokens, a fast hash is enough, unlike for passwords
+    return hashlib.sha256(api_key.encode()).digest()
+
+
+def generate_key() -> str:
+    return KEY_PREFIX + secrets.token_urlsafe(32)
+
+
+class RateLimit:
+    ''' token bucket, rate tokens per second up to burst '''
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+def _remember(entries: dict, max_entries: int, key, value):
+    if key not in entries and len(entries) >= max_entries:
+        # dicts keep insertion order, so this drops the oldest entry
+        del entries[next(iter(entries))]
+    entries[key] = value
+
+
+class ApiKeyCache:
+    '''
+    Verified keys by hash, so a request with a known key costs one sha256 and a dict lookup.
+    Unknown keys are remembered for a shorter time in a store of their own, so a flood of
+    random keys cannot push valid ones out, and the lookups they cause are rate limited.
+    Revocations are published with NOTIFY and dropped by every worker, the TTL bounds
+    staleness if a notification is missed.
+    '''
+
+    def __init__(self, ttl: float, negative_ttl: float, lookups_per_second: float,
+                 max_entries: int = 10000, max_unknown: int = 10000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.max_unknown = max_unknown
+        self._entries: Dict[bytes, Tuple[float, ApiKey]] = {}
+        self._unknown: Dict[bytes, float] = {}
+        self._lookups = RateLimit(lookups_per_second, lookups_per_second)
+        self.single_flight = SingleFlight('api_keys')
+
+    async def verify(self, api_key: str) -> Optional[ApiKey]:
+        # the lookup is by sha256 of the key, so timing reveals nothing about the stored keys
+        key_hash = hash_key(api_key)
+        now = time.monotonic()
+        entry = self._entries.get(key_hash)
+        if entry is not None and entry[0] >= now:
+            return entry[1]
+        if self._unknown.get(key_hash, 0) >= now:
+            return None
+        # a lookup already in flight for this key costs nothing more
+        if key_hash not in self.single_flight and not self._lookups.take():
+            raise Overloaded()
+        return await self.single_flight.do(key_hash, lambda: self._load(key_hash))
+
+    async def _load(self, key_hash: bytes) -> Optional[ApiKey]:
+        # every request is authenticated first, the lookup goes ahead of the queries it guards
+        async with acquire_connection('priority') as connection:
+            row = await connection.fetchrow('''
+                SELECT id_key, client, key_hash, scopes,
+                    EXTRACT(EPOCH FROM expires_at - CURRENT_TIMESTAMP) AS expires_in
+                FROM ApiKeys
+                WHERE key_hash = $1 AND revoked_at IS NULL
+                    AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+            ''', key_hash)
+
+        if row is None:
+            _remember(self._unknown, self.max_unknown, key_hash, time.monotonic() + self.negative_ttl)
+            return None
+
+        key = ApiKey(row['id_key'], row['client'], bytes(row['key_hash']), frozenset(row['scopes']))
+        ttl = self.ttl if row['expires_in'] is None else min(self.ttl, float(row['expires_in']))
+        _remember(self._entries, self.max_entries, key_hash, (time.monotonic() + ttl, key))
+        return key
+
+    def on_notify(self, payload: str):
+        self._entries.pop(bytes.fromhex(payload), None)
+
+    def clear(self):
+        self._entries.clear()
+        self._unknown.clear()
+
+    async def resync(self, connection: Connection):
+        ''' revocations may have been missed, every key is looked up again '''
+        self.clear()
+
+    async def create(self, connection: Connection, client: str, scopes: List[str],
+                     expires_in_seconds: Optional[float] = None) -> Tuple[uuid.UUID, str]:
+        ''' returns the id and the key, the key itself is not stored and cannot be shown again '''
+        api_key = generate_key()
+        id_key = await connection.fetchval('''
+            INSERT INTO ApiKeys (client, key_hash, scopes, expires_at)
+            VALUES ($1, $2, $3, CURRENT_TIMESTAMP + make_interval(secs => $4))
+            RETURNING id_key
+        ''', client, hash_key(api_key), scopes, expires_in_seconds)
+        return id_key, api_key
+
+    async def revoke(self, connection: Connection, id_key: uuid.UUID) -> bool:
+        async with connection.transaction():
+            key_hash = await connection.fetchval('''
+                UPDATE ApiKeys SET revoked_at = CURRENT_TIMESTAMP
+                WHERE id_key = $1 AND revoked_at IS NULL
+                RETURNING key_hash
+            ''', id_key)
+            if key_hash is None:
+                return False
+            await connection.execute('SELECT pg_notify($1, $2)', CHANNEL, bytes(key_hash).hex())
+        self.on_notify(bytes(key_hash).hex())
+        return True
+
+
+async def delete_expired_keys(connection: Connection):
+    await connection.execute('DELETE FROM ApiKeys WHERE expires_at < CURRENT_TIMESTAMP')
+
+
+async def bootstrap_credentials(connection: Connection):
+    '''
+    The key and login from the environment become the first admin credentials.
+    They follow the environment: a changed API_PASSWORD replaces the stored one,
+    a changed API_KEY revokes the bootstrap key it replaces.
+    '''
+    key_hash = hash_key(settings.api_key)
+    async with connection.transaction():
+        await connection.execute('''
+            INSERT INTO ApiKeys (client, key_hash, scopes) VALUES ('bootstrap', $1, '{*}')
+            ON CONFLICT (key_hash) DO NOTHING
+        ''', key_hash)
+        for row in await connection.fetch('''
+            UPDATE ApiKeys SET revoked_at = CURRENT_TIMESTAMP
+            WHERE client = 'bootstrap' AND key_hash <> $1 AND revoked_at IS NULL
+            RETURNING key_hash
+        ''', key_hash):
+            # running workers of another deployment drop it from their caches
+            await connection.execute('SELECT pg_notify($1, $2)', CHANNEL, bytes(row['key_hash']).hex())
+
+        password_hash = await connection.fetchval(
+            'SELECT password_hash FROM ApiUsers WHERE login = $1 FOR UPDATE', settings.api_user
+        )
+        if password_hash is None:
+            await connection.execute('''
+                INSERT INTO ApiUsers (login, password_hash, scopes) VALUES ($1, $2, '{*}')
+                ON CONFLICT (login) DO NOTHING
+            ''', settings.api_user, hash_password(settings.api_password))
+        elif not verify_password(settings.api_password, password_hash):
+            await connection.execute(
+                'UPDATE ApiUsers SET password_hash = $2 WHERE login = $1',
+                settings.api_user, hash_password(settings.api_password)
+            )
+
+
+api_key_cache = ApiKeyCache(
+    ttl=settings.api_key_cache_ttl,
+    negative_ttl=settings.api_key_negative_ttl,
+    lookups_per_second=settings.api_key_lookups_per_second
+)
@@ -0,0 +1,141 @@
+from asyncpg import Connection
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+import json
+import re
+import sys
+import uuid
+
+
+# origin marker, so a worker skips its own notifications
+PROCESS_ID = uuid.uuid4().hex
+CHANNEL = 'autocomplete'
+
+# kind -> (table, id column, label column)
+SOURCES = {
+    'books': ('Books', 'id_book', 'title'),
+    'authors': ('Authors', 'id_author', 'author_name'),
+    'genres': ('Genres', 'id_genre', 'genre_name'),
+    'users': ('Users', 'id_user', 'full_name'),
+}
+
+
+def _index_keys(label: str) -> List[str]:
+    ''' normalized label suffixes starting at every word, so "leo tolstoy" matches "tol" '''
+    normalized = label.casefold()
+    return [normalized[match.start():] for match in re.finditer(r'\w+', normalized)]
+
+
+class PrefixIndex:
+    ''' sorted parallel arrays of (key, id), searched with bisect '''
+
+    def __init__(self):
+        self._keys: List[str] = []
+        self._ids: List[str] = []
+        self._labels: Dict[str, str] = {}
+
+    def __len__(self):
+        return len(self._labels)
+
+    def build(self, items: List[Tuple[str, str]]):
+        pairs = sorted((key, id_) for id_, label in items for key in _index_keys(label))
+        self._keys = [key for key, _ in pairs]
+        self._ids = [id_ for _, id_ in pairs]
+        self._labels = dict(items)
+
+    def add(self, id_: str, label: str):
+        self.remove(id_)
+        for key in _index_keys(label):
+            i = bisect_right(self._keys, key)
+            self._keys.insert(i, key)
+            self._ids.insert(i, id_)
+        self._labels[id_] = label
+
+    def remove(self, id_: str):
+        label = self._labels.pop(id_, None)
+        if label is None:
+            return
+        for key in _index_keys(label):
+            i = bisect_left(self._keys, key)
+            while i < len(self._keys) and self._keys[i] == key:
+                if self._ids[i] == id_:
+                    del self._keys[i]
+                    del self._ids[i]
+                    break
+                i += 1
+
+    def search(self, prefix: str, limit: int) -> List[dict]:
+        prefix = prefix.casefold()
+        result = []
+        seen = set()
+        i = bisect_left(self._keys, prefix)
+        while i < len(self._keys) and len(result) < limit and self._keys[i].startswith(prefix):
+            id_ = self._ids[i]
+            if id_ not in seen:
+                seen.add(id_)
+                result.append({'id': id_, 'label': self._labels[id_]})
+            i += 1
+        return result
+
+    def memory_usage(self) -> int:
+        size = sys.getsizeof(self._keys) + sys.getsizeof(self._ids) + sys.getsizeof(self._labels)
+        size += sum(sys.getsizeof(key) for key in self._keys)
+        size += sum(sys.getsizeof(id_) + sys.getsizeof(label) for id_, label in self._labels.items())
+        return size
+
+
+class AutocompleteIndex:
+    def __init__(self):
+        self.indexes = {kind: PrefixIndex() for kind in SOURCES}
+        # changes that arrive while load() reads the tables, build() would overwrite them
+        self._pending: Optional[List[Tuple[str, str, Optional[str]]]] = None
+
+    async def load(self, connection: Connection):
+        self._pending = []
+        try:
+            for kind, (table, id_column, label_column) in SOURCES.items():
+                rows = await connection.fetch(f'SELECT {id_column}, {label_column} FROM {table}')
+                self.indexes[kind].build([(str(row[0]), row[1]) for row in rows])
+        finally:
+            pending, self._pending = self._pending, None
+        # replaying a change the snapshot already has is harmless, add and remove are idempotent
+        for change in pending:
+            self.apply(*change)
+
+    def apply(self, kind: str, id_: str, label: Optional[str]):
+        if self._pending is not None:
+            self._pending.append((kind, id_, label))
+            return
+        if label is None:
+            self.indexes[kind].remove(id_)
+        else:
+            self.indexes[kind].add(id_, label)
+
+    def on_notify(self, payload: str):
+        message = json.loads(payload)
+        if message['origin'] != PROCESS_ID:
+            self.apply(message['kind'], message['id'], message['label'])
+
+    async def publish(self, connection: Connection, kind: str, id_, label: Optional[str] = None):
+        ''' apply a change locally and broadcast it to the other workers, label None means delete '''
+        self.apply(kind, str(id_), label)
+        payload = json.dumps({'origin': PROCESS_ID, 'kind': kind, 'id': str(id_), 'label': label})
+        await connection.execute('SELECT pg_notify($1, $2)', CHANNEL, payload)
+
+    def search(self, prefix: str, kinds: List[str], limit: int) -> Dict[str, List[dict]]:
+        return {kind: self.indexes[kind].search(prefix, limit) for kind in kinds}
+
+    def stats(self) -> Dict[str, dict]:
+        result = {}
+        for kind, index in self.indexes.items():
+            entries = len(index)
+            memory = index.memory_usage()
+            result[kind] = {
+                'entries': entries,
+                'memory_bytes': memory,
+                'bytes_per_million_entries': memory * 1_000_000 // entries if entries else 0,
+            }
+        return result
+
+
+autocomplete_index = AutocompleteIndex()
@@ -0,0 +1,43 @@
+from asyncpg import Connection
+from typing import Dict, List, Tuple
+from uuid import UUID
+import json
+
+
+async def fetch_books(connection: Connection, ids: List[UUID]) -> Dict[UUID, dict]:
+    # "id_book = ANY(...)" does not reach the view's author and genre aggregates, they would be
+    # computed for every book; one lookup per id does, OFFSET 0 keeps the planner from flattening it
+    query = '''
+        SELECT d.id_book, d.title, d.authors, d.genres
+        FROM unnest($1::uuid[]) AS ids(id_book)
+        CROSS JOIN LATERAL (
+            SELECT * FROM BookDetails WHERE BookDetails.id_book = ids.id_book OFFSET 0
+        ) AS d
+    '''
+    books = {}
+    for book in await connection.fetch(query, list(set(ids))):
+        book_dict = dict(book)
+        book_dict['authors'] = json.loads(book_dict['authors'])
+        book_dict['genres'] = json.loads(book_dict['genres'])
+        books[book_dict['id_book']] = book_dict
+    return books
+
+
+async def fetch_users(connection: Connection, ids: List[UUID]) -> Dict[UUID, dict]:
+    query = '''
+        SELECT id_user, full_name, birth_date, address, phone_number FROM Users WHERE id_user = ANY($1::uuid[])
+    '''
+    return {user['id_user']: dict(user) for user in await connection.fetch(query, list(set(ids)))}
+
+
+async def fetch_borrows(connection: Connection, ids: List[UUID]) -> Dict[UUID, dict]:
+    query = '''
+        SELECT id_borrow, id_user, id_book, is_returned, borrow_date, return_date
+        FROM BorrowReturnLogs WHERE id_borrow = ANY($1::uuid[])
+    '''
+    return {borrow['id_borrow']: dict(borrow) for borrow in await connection.fetch(query, list(set(ids)))}
+
+
+def in_request_order(ids: List[UUID], found: Dict[UUID, dict]) -> Tuple[List, List[UUID]]:
+    ''' results in the order of ids, None in place of missing ones, plus the missing ids '''
+    return [found.get(id_) for id_ in ids], [id_ for id_ in ids if id_ not in found]
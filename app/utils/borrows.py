@@ -0,0 +1,23 @@
+# live and archived borrows with the same columns, archived ones are always returned
+ALL_BORROWS = '''
+    SELECT id_borrow, id_user, id_book, is_returned, borrow_date, return_date, created_at
+    FROM BorrowReturnLogs
+    UNION ALL
+    SELECT id_borrow, id_user, id_book, TRUE, borrow_date, return_date, created_at
+    FROM BorrowReturnLogsArchive
+'''
+
+
+def borrows_source(include_archived: bool, alias: str = 'BorrowReturnLogs') -> str:
+    ''' table expression for FROM, live borrows only unless include_archived '''
+    if include_archived:
+        return f'({ALL_BORROWS}) AS {alias}'
+    return f'BorrowReturnLogs AS {alias}'
+
+
+def book_is_out(book: str) -> str:
+    ''' condition on a book column: the book has an open borrow, idx_borrow_open_book allows one per book '''
+    return f'''EXISTS (
+        SELECT 1 FROM BorrowReturnLogs open_borrow
+        WHERE open_borrow.id_book = {book} AND open_borrow.is_returned = FALSE
+    )'''
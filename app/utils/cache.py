@@ -0,0 +1,151 @@
+from asyncpg import Connection
+from fastapi.encoders import jsonable_encoder
+from typing import Any, AsyncGenerator, Dict, Optional, Tuple
+import json
+import random
+import time
+import uuid
+
+from database import acquire_connection, acquire_read_connection
+from settings import settings
+from .singleflight import SingleFlight, deferred_connection_endpoint
+
+
+class MemoryCacheBackend:
+    ''' per-process cache, dropped entirely whenever the data changes '''
+    shared = False
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: Dict[str, Tuple[float, Any]] = {}
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    async def set(self, key: str, value: Any, ttl: float):
+        if len(self._entries) >= self.max_entries:
+            # dicts keep insertion order, so this drops the oldest entry
+            del self._entries[next(iter(self._entries))]
+        self._entries[key] = (time.monotonic() + ttl, value)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class PostgresCacheBackend:
+    ''' cache shared by all workers in an unlogged table, stale generations just expire '''
+    shared = True
+
+    async def get(self, key: str) -> Optional[Any]:
+        async with acquire_connection() as connection:
+            value = await connection.fetchval(
+                'SELECT value FROM ResponseCache WHERE cache_key = $1 AND expires_at > CURRENT_TIMESTAMP', key
+            )
+        return None if value is None else json.loads(value)
+
+    async def set(self, key: str, value: Any, ttl: float):
+        async with acquire_connection() as connection:
+            await connection.execute('''
+                INSERT INTO ResponseCache (cache_key, value, expires_at)
+                VALUES ($1, $2, CURRENT_TIMESTAMP + make_interval(secs => $3))
+                ON CONFLICT (cache_key) DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at
+            ''', key, json.dumps(value), ttl)
+            if random.random() < 0.01:
+                await connection.execute('DELETE FROM ResponseCache WHERE expires_at < CURRENT_TIMESTAMP')
+
+    def clear(self):
+        pass
+
+
+BACKENDS = {
+    'memory': MemoryCacheBackend,
+    'postgres': PostgresCacheBackend,
+}
+
+
+class ResponseCache:
+    '''
+    Caches encoded responses under the current generation token.
+    A write replaces the token, so every older entry becomes unreachable at once.
+    '''
+
+    def __init__(self, name: str, backend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self.channel = f'{name}_cache'
+        self.generation = uuid.uuid4().hex
+        # the transaction that started the generation, entries are computed where it is visible
+        self.xact: Optional[str] = None
+        self.single_flight = SingleFlight(name)
+
+    async def get_or_compute(self, key: str, compute):
+        key = f'{self.generation}:{key}'
+        value = await self.backend.get(key)
+        if value is not None:
+            return value
+
+        async def load():
+            value = jsonable_encoder(await compute())
+            await self.backend.set(key, value, self.ttl)
+            return value
+
+        return await self.single_flight.do(key, load)
+
+    async def connection(self) -> AsyncGenerator[Connection, None]:
+        '''
+        Dependency of the cached endpoints: a replica that has replayed the write which
+        started the current generation, the primary while none has
+        '''
+        async with acquire_read_connection('report', after_xact=self.xact) as connection:
+            yield connection
+
+    def _set_generation(self, generation: str):
+        self.generation = generation
+        if not self.backend.shared:
+            self.backend.clear()
+
+    async def load(self, connection: Connection):
+        ''' a shared backend starts from the generation every worker uses '''
+        if self.backend.shared:
+            self.generation = str(await connection.fetchval('SELECT last_value FROM ResponseCacheGeneration'))
+
+    async def resync(self, connection: Connection):
+        ''' invalidations may have been missed, nothing cached so far can be trusted '''
+        self.xact = None
+        self._set_generation(uuid.uuid4().hex)
+        await self.load(connection)
+
+    def on_notify(self, payload: str):
+        generation, self.xact = payload.split()
+        self._set_generation(generation)
+
+    async def invalidate(self, connection: Connection):
+        '''
+        Drops entries right away and again on commit, when the notification arrives,
+        so a result computed from data the transaction had not committed yet is not kept.
+        The generation comes from a sequence, the writing transaction locks no shared row.
+        '''
+        self._set_generation(uuid.uuid4().hex)
+        await connection.execute(
+            "SELECT pg_notify($1, nextval('ResponseCacheGeneration') || ' ' || pg_current_xact_id())",
+            self.channel
+        )
+
+    def cached(self, name: str):
+        '''
+        Endpoint decorator. The handler's connection dependency is resolved only on a miss,
+        so cache hits and requests waiting on the same miss hold no database connection.
+        '''
+        def decorator(handler):
+            return deferred_connection_endpoint(handler, name, self.get_or_compute)
+        return decorator
+
+
+report_cache = ResponseCache(
+    name='reports',
+    backend=BACKENDS[settings.response_cache_backend](),
+    ttl=settings.response_cache_ttl
+)
@@ -0,0 +1,166 @@
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing import Any, List, Optional
+import asyncio
+import gzip
+import json
+
+from settings import settings
+
+# both are optional, the matching Accept values are simply not offered without them
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+JSON = 'application/json'
+COLUMNAR = 'application/vnd.library.columnar+json'
+MSGPACK = 'application/msgpack'
+
+# zlib and brotli release the GIL, bigger bodies are compressed off the event loop
+THREAD_COMPRESS_SIZE = 64 * 1024
+
+
+def to_columnar(value: Any) -> Any:
+    ''' lists of objects with the same keys become {"columns": [...], "rows": [[...], ...]} '''
+    if isinstance(value, dict):
+        return {key: to_columnar(item) for key, item in value.items()}
+    if isinstance(value, list):
+        if value and all(isinstance(item, dict) for item in value):
+            keys = value[0].keys()
+            if all(item.keys() == keys for item in value):
+                columns = list(keys)
+                return {
+                    'columns': columns,
+                    'rows': [[to_columnar(item[column]) for column in columns] for item in value]
+                }
+        return [to_columnar(item) for item in value]
+    return value
+
+
+def encode(body: bytes, media_type: str) -> bytes:
+    ''' re-encodes a JSON body as media_type '''
+    if media_type == JSON:
+        return body
+    value = json.loads(body)
+    if media_type == COLUMNAR:
+        return json.dumps(to_columnar(value), ensure_ascii=False, separators=(',', ':')).encode()
+    return msgpack.packb(value)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=settings.brotli_quality)
+    return gzip.compress(body, compresslevel=settings.gzip_level)
+
+
+def negotiate(header: str, offered: List[str]) -> Optional[str]:
+    '''
+    The offered value the client weighs highest, ties go to the earlier offer.
+    None if the client accepts none of them.
+    '''
+    weights = {}
+    for part in header.split(','):
+        name, *params = [item.strip() for item in part.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if name:
+            weights[name.lower()] = quality
+
+    best, best_quality = None, 0.0
+    for value in offered:
+        quality = weights.get(value)
+        if quality is None:
+            quality = weights.get('*/*' if '/' in value else '*', 0.0)
+        if quality > best_quality:
+            best, best_quality = value, quality
+    return best
+
+
+def _vary(start: Message) -> Message:
+    headers = MutableHeaders(scope=start)
+    headers.add_vary_header('Accept')
+    headers.add_vary_header('Accept-Encoding')
+    return start
+
+
+class ContentNegotiationMiddleware:
+    '''
+    Re-encodes JSON responses as columnar JSON or MessagePack when the Accept header
+    asks for it, and compresses bodies above minimum_size with br or gzip per
+    Accept-Encoding. Streamed responses pass through unchanged. Every response gets
+    Vary: Accept, Accept-Encoding, caches must not hand one variant to another client.
+    '''
+
+    def __init__(self, app: ASGIApp, minimum_size: int):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.media_types = [JSON, COLUMNAR] + ([MSGPACK] if msgpack is not None else [])
+        self.encodings = (['br'] if brotli is not None else []) + ['gzip']
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        media_type = negotiate(headers.get('accept', JSON), self.media_types) or JSON
+        encoding = negotiate(headers.get('accept-encoding', ''), self.encodings)
+        if media_type == JSON and encoding is None:
+            async def send_varied(message: Message):
+                if message['type'] == 'http.response.start':
+                    _vary(message)
+                await send(message)
+
+            await self.app(scope, receive, send_varied)
+            return
+
+        start: Optional[Message] = None
+        chunks: List[bytes] = []
+        streaming = False
+
+        async def send_negotiated(message: Message):
+            nonlocal start, streaming
+            if streaming:
+                await send(message)
+            elif message['type'] == 'http.response.start':
+                start = _vary(message)
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+                if message.get('more_body', False):
+                    streaming = True
+                    await send(start)
+                    await send({'type': 'http.response.body', 'body': b''.join(chunks), 'more_body': True})
+                else:
+                    await self._send(send, start, b''.join(chunks), media_type, encoding)
+            else:
+                await send(message)
+
+        await self.app(scope, receive, send_negotiated)
+
+    async def _send(self, send: Send, start: Message, body: bytes, media_type: str, encoding: Optional[str]):
+        headers = MutableHeaders(raw=start['headers'])
+        if body and headers.get('content-type', '').startswith(JSON) and media_type != JSON:
+            body = encode(body, media_type)
+            headers['content-type'] = media_type
+
+        if encoding is not None and len(body) >= self.minimum_size and 'content-encoding' not in headers:
+            if len(body) >= THREAD_COMPRESS_SIZE:
+                body = await asyncio.to_thread(compress, body, encoding)
+            else:
+                body = compress(body, encoding)
+            headers['content-encoding'] = encoding
+
+        headers['content-length'] = str(len(body))
+        await send(start)
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,47 @@
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Tuple
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Metrics:
+    ''' per-process counters and summaries rendered in prometheus text format '''
+
+    def __init__(self):
+        self._counters: Dict[Tuple[str, Labels], float] = defaultdict(float)
+        self._summaries: Dict[Tuple[str, Labels], list] = defaultdict(lambda: [0, 0.0])
+        self._collectors: List[Callable[[], Iterable[Tuple[str, dict, float]]]] = []
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name: str, value: float, **labels: str):
+        summary = self._summaries[(name, tuple(sorted(labels.items())))]
+        summary[0] += 1
+        summary[1] += value
+
+    def register(self, collector: Callable[[], Iterable[Tuple[str, dict, float]]]):
+        ''' collector yields (name, labels, value) samples owned by another module, read at render time '''
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for (name, labels), value in sorted(self._counters.items()):
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+        for (name, labels), (count, total) in sorted(self._summaries.items()):
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                lines.append(f'{name}{_format_labels(tuple(sorted(labels.items())))} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+metrics = Metrics()
@@ -0,0 +1,122 @@
+import asyncio
+import asyncpg
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from database import db_connect
+from settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+# seconds between reconnect attempts, the last one repeats
+RECONNECT_DELAYS = (0.5, 1, 2, 5)
+
+
+class Listener:
+    '''
+    Dedicated connection that dispatches postgres NOTIFY payloads to callbacks.
+    Notifications sent while it is disconnected are lost, so after a reconnect
+    the resync callbacks rebuild whatever the missed notifications would have changed.
+    '''
+
+    def __init__(self):
+        self._connection: Optional[asyncpg.Connection] = None
+        self._callbacks: Dict[str, List[Callable[[str], None]]] = {}
+        self._resyncs: List[Callable[[asyncpg.Connection], Awaitable[None]]] = []
+        self._lost = asyncio.Event()
+        # false from losing the connection until the resync callbacks ran on the new one
+        self._in_sync = False
+        self._monitor: Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._in_sync and not self._connection.is_closed()
+
+    async def start(self):
+        await self._connect()
+        self._in_sync = True
+        self._monitor = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
+            self._monitor = None
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+        self._in_sync = False
+
+    async def subscribe(self, channel: str, callback: Callable[[str], None]):
+        if channel not in self._callbacks:
+            self._callbacks[channel] = []
+            if self.connected:
+                await self._connection.add_listener(channel, self._dispatch)
+        self._callbacks[channel].append(callback)
+
+    def on_reconnect(self, resync: Callable[[asyncpg.Connection], Awaitable[None]]):
+        ''' resync runs on the listener connection after it is listening again '''
+        self._resyncs.append(resync)
+
+    async def _connect(self):
+        connection = await db_connect()
+        try:
+            for channel in self._callbacks:
+                await connection.add_listener(channel, self._dispatch)
+        except BaseException:
+            connection.terminate()
+            raise
+        connection.add_termination_listener(self._on_termination)
+        self._lost.clear()
+        self._connection = connection
+
+    def _on_termination(self, connection):
+        if connection is self._connection:
+            self._in_sync = False
+            self._lost.set()
+
+    async def _alive(self) -> bool:
+        ''' a connection cut off without a reset is only noticed by using it '''
+        try:
+            await self._connection.fetchval('SELECT 1', timeout=settings.listener_check_interval)
+            return True
+        except Exception:
+            return False
+
+    async def _watch(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._lost.wait(), settings.listener_check_interval)
+            except asyncio.TimeoutError:
+                if await self._alive():
+                    continue
+            logger.warning('Notification listener lost its connection, reconnecting')
+            self._in_sync = False
+            self._connection.terminate()
+            await self._reconnect()
+
+    async def _reconnect(self):
+        attempt = 0
+        while True:
+            try:
+                await self._connect()
+                for resync in self._resyncs:
+                    await resync(self._connection)
+            except Exception:
+                logger.warning('Notification listener reconnect failed', exc_info=True)
+                if self._connection is not None:
+                    self._connection.terminate()
+                await asyncio.sleep(RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)])
+                attempt += 1
+                continue
+            self._in_sync = True
+            logger.info('Notification listener reconnected')
+            return
+
+    def _dispatch(self, connection, pid, channel, payload):
+        for callback in self._callbacks.get(channel, []):
+            callback(payload)
+
+
+listener = Listener()
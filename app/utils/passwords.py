@@ -0,0 +1,29 @@
+import hashlib
+import hmac
+import secrets
+
+
+# about 16 MB and a few dozen ms per hash
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+
+def hash_password(password: str) -> str:
+    ''' scrypt$n$r$p$salt$hash with hex salt and hash '''
+    salt = secrets.token_bytes(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+    return f'scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}'
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    _, n, r, p, salt, digest = password_hash.split('$')
+    expected = bytes.fromhex(digest)
+    actual = hashlib.scrypt(
+        password.encode(), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p), dklen=len(expected)
+    )
+    return hmac.compare_digest(actual, expected)
+
+
+# checked when the login does not exist, so unknown logins take as long as wrong passwords
+DUMMY_HASH = hash_password(secrets.token_hex(16))
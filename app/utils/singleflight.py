@@ -0,0 +1,104 @@
+from contextlib import asynccontextmanager
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+import asyncio
+import functools
+import inspect
+
+from .metrics import metrics
+
+
+class _Call:
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    '''
+    Concurrent calls with the same key share one execution of fn. It runs in its own task,
+    so a cancelled caller, the first one included, does not cancel it for the others;
+    it is cancelled only when no caller is left waiting for it.
+    '''
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        ''' a call with this key is in flight '''
+        return key in self._calls
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is not None:
+            metrics.inc('singleflight_coalesced_total', flight=self.name)
+        else:
+            metrics.inc('singleflight_executions_total', flight=self.name)
+            call = self._calls[key] = _Call()
+
+            async def run():
+                try:
+                    return await fn()
+                finally:
+                    self._forget(key, call)
+
+            call.task = asyncio.create_task(run())
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.task.done():
+                # every caller was cancelled, nobody is left for the result
+                self._forget(key, call)
+                call.task.cancel()
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+
+def deferred_connection_endpoint(handler, name: str, run: Callable[[str, Callable[[], Awaitable[Any]]], Awaitable[Any]]):
+    '''
+    Wraps an endpoint so its connection dependency is resolved only when run() calls compute.
+    run gets a key built from the route name and the request parameters.
+    '''
+    signature = inspect.signature(handler)
+    connection_dependency = signature.parameters['connection'].default.dependency
+    parameters = [p for p in signature.parameters.values() if p.name != 'connection']
+
+    @functools.wraps(handler)
+    async def wrapper(**kwargs):
+        key = name + '?' + '&'.join(f'{k}={v}' for k, v in sorted(kwargs.items()))
+
+        async def compute():
+            async with asynccontextmanager(connection_dependency)() as connection:
+                return await handler(connection=connection, **kwargs)
+
+        return await run(key, compute)
+
+    wrapper.__signature__ = signature.replace(parameters=parameters)
+    return wrapper
+
+
+def coalesce(name: str):
+    '''
+    Endpoint decorator: identical in-flight requests share one query and one serialized body.
+    Only for reads that may lag behind a write committed while the query was running.
+    '''
+    def decorator(handler):
+        flight = SingleFlight(name)
+
+        async def run(key, compute):
+            async def serialize():
+                return JSONResponse(jsonable_encoder(await compute())).body
+
+            body = await flight.do(key, serialize)
+            return Response(content=body, media_type='application/json')
+
+        return deferred_connection_endpoint(handler, name, run)
+    return decorator